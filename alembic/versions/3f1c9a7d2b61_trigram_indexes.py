@@ -0,0 +1,36 @@
+"""Trigram indexes for autocomplete
+
+Revision ID: 3f1c9a7d2b61
+Revises: 980742dba9e4
+Create Date: 2026-10-19 10:12:40.114382
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b61'
+down_revision: Union[str, Sequence[str], None] = '980742dba9e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_tags_name_trgm', 'tags', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'})
+    op.create_index('ix_posts_title_trgm', 'posts', ['title'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_title_trgm', table_name='posts', postgresql_using='gin')
+    op.drop_index('ix_users_username_trgm', table_name='users', postgresql_using='gin')
+    op.drop_index('ix_tags_name_trgm', table_name='tags', postgresql_using='gin')
@@ -9,6 +9,7 @@ from typing import Sequence, Union
 
 from alembic import op
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 
 
 # revision identifiers, used by Alembic.
@@ -18,15 +19,101 @@ branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
+# enum types stored by member name, as SQLEnum(StrEnum) does
+roles = postgresql.ENUM('USER', 'MODERATOR', 'ADMIN', name='roles', create_type=False)
+occupation_grades = postgresql.ENUM('TRAINEE', 'JUNIOR', 'MIDDLE', 'SENIOR', 'LEAD', name='occupationgrades',
+                                    create_type=False)
+post_status = postgresql.ENUM('DRAFT', 'PUBLIC', 'ARCHIVED', name='poststatus', create_type=False)
+
+
 def upgrade() -> None:
     """Upgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    # the schema as it was at this revision, later revisions relax, index and cascade it
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for enum in (roles, occupation_grades, post_status):
+        enum.create(op.get_bind(), checkfirst=True)
+
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('username', sa.String(length=50), nullable=False),
+        sa.Column('email', sa.String(length=50), nullable=False),
+        sa.Column('password', sa.String(length=255), nullable=False),
+        sa.Column('first_name', sa.String(length=50), nullable=True),
+        sa.Column('last_name', sa.String(length=50), nullable=True),
+        sa.Column('bio', sa.Text(), nullable=True),
+        sa.Column('occupation', sa.String(length=50), nullable=False),
+        sa.Column('occupation_grade', occupation_grades, nullable=False),
+        sa.Column('last_login', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('is_verified', sa.Boolean(), nullable=False),
+        sa.Column('role', roles, nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+        sa.UniqueConstraint('email'),
+    )
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'posts',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=50), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('published_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('rating', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('view_count', sa.Integer(), nullable=False),
+        sa.Column('status', post_status, nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'votes',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('author_id', 'post_id', name='_user_post_uc'),
+    )
+    op.create_table(
+        'comments',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['parent_id'], ['comments.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # association tables without cascades yet, c4a8e2f61d93 recreates these constraints by name
+    for table, left, right in (('tags_to_users', 'user', 'tag'), ('tags_to_posts', 'post', 'tag'),
+                               ('bookmarks', 'user', 'post')):
+        op.create_table(
+            table,
+            sa.Column(f'{left}_id', sa.Integer(), nullable=False),
+            sa.Column(f'{right}_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint([f'{left}_id'], [f'{left}s.id'], name=f'{table}_{left}_id_fkey'),
+            sa.ForeignKeyConstraint([f'{right}_id'], [f'{right}s.id'], name=f'{table}_{right}_id_fkey'),
+            sa.PrimaryKeyConstraint(f'{left}_id', f'{right}_id'),
+        )
 
 
 def downgrade() -> None:
     """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    pass
-    # ### end Alembic commands ###
+    for table in ('bookmarks', 'tags_to_posts', 'tags_to_users', 'comments', 'votes', 'posts', 'tags', 'users'):
+        op.drop_table(table)
+    for enum in (post_status, occupation_grades, roles):
+        enum.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,56 @@
+"""Author stats without soft deleted posts
+
+Revision ID: 5e9d3b7f0a24
+Revises: c4a8e2f61d93
+Create Date: 2026-10-19 16:20:43.118207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e9d3b7f0a24'
+down_revision: Union[str, Sequence[str], None] = 'c4a8e2f61d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def create_view(live_posts: str) -> None:
+    op.execute(f"""
+        CREATE MATERIALIZED VIEW author_stats AS
+        SELECT users.id AS user_id,
+               coalesce(p.post_count, 0) AS post_count,
+               coalesce(p.total_rating, 0) AS total_rating,
+               coalesce(p.total_views, 0) AS total_views,
+               coalesce(c.comment_count, 0) AS comment_count,
+               coalesce(p.total_rating, 0) + coalesce(c.comment_count, 0) AS karma
+        FROM users
+        LEFT JOIN (
+            SELECT author_id, count(*) AS post_count, sum(rating) AS total_rating, sum(view_count) AS total_views
+            FROM posts WHERE {live_posts} GROUP BY author_id
+        ) p ON p.author_id = users.id
+        LEFT JOIN (
+            SELECT posts.author_id, count(*) AS comment_count
+            FROM comments JOIN posts ON posts.id = comments.post_id
+            WHERE comments.author_id != posts.author_id AND {live_posts}
+            GROUP BY posts.author_id
+        ) c ON c.author_id = users.id
+    """)
+    op.execute("CREATE UNIQUE INDEX ix_author_stats_user_id ON author_stats (user_id)")
+    op.execute("CREATE INDEX ix_author_stats_karma ON author_stats (karma DESC, user_id)")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a view definition cant be altered in place, the indexes go with it
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS author_stats")
+    create_view("posts.deleted_at IS NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS author_stats")
+    create_view("true")
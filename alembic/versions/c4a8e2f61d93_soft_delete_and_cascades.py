@@ -0,0 +1,51 @@
+"""Soft delete markers and cascading association tables
+
+Revision ID: c4a8e2f61d93
+Revises: 7b2e4d9c1a08
+Create Date: 2026-10-19 12:41:05.872230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a8e2f61d93'
+down_revision: Union[str, Sequence[str], None] = '7b2e4d9c1a08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (table, column, referred table)
+association_fks = [
+    ('tags_to_posts', 'post_id', 'posts'),
+    ('tags_to_posts', 'tag_id', 'tags'),
+    ('tags_to_users', 'user_id', 'users'),
+    ('tags_to_users', 'tag_id', 'tags'),
+    ('bookmarks', 'user_id', 'users'),
+    ('bookmarks', 'post_id', 'posts'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('posts', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    for table, column, referred in association_fks:
+        name = f'{table}_{column}_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referred, [column], ['id'], ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, column, referred in association_fks:
+        name = f'{table}_{column}_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referred, [column], ['id'])
+
+    op.drop_column('posts', 'deleted_at')
+    op.drop_column('users', 'deleted_at')
@@ -0,0 +1,272 @@
+"""
+End to end load of the api: virtual users run a weighted mix of the routes in api/v1/users.py,
+posts.py, comments.py and search.py, throughput and p50/p95/p99 latency are reported per scenario.
+
+Run with `python -m benchmarks.bench_load [--url http://localhost:8000] [--duration 30] ...`
+against a database seeded by `python -m tools.seed`, logins use its users and password.
+Without --url the app runs in process with fakeredis standing in for redis unless REDIS_BACKEND=redis,
+postgres is always real. The in process app gets rate limits out of the way, a server behind --url needs
+RATE_LIMIT_* raised by whoever starts it.
+
+--out saves the results as json, --baseline compares against an earlier file and fails when a
+scenario got slower or less frequent than the thresholds allow.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable
+
+import httpx
+
+# every virtual user shares one ip in process, the limits would measure themselves
+for _name in ("LOGIN", "REGISTER", "SEARCH", "WRITE", "IMPORT"):
+    os.environ.setdefault(f"RATE_LIMIT_{_name}", "1000000000/1")
+os.environ.setdefault("JOBS_BACKEND", "fakeredis")
+os.environ.setdefault("REDIS_BACKEND", "fakeredis")
+
+from tools.seed import SEED_PASSWORD, WORDS, Zipf, popular_posts
+
+
+@dataclass
+class Stats():
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else 0.0
+
+    def summary(self, duration: float) -> dict:
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "rps": round(len(self.latencies) / duration, 1),
+            "p50_ms": round(self.percentile(0.50), 2),
+            "p95_ms": round(self.percentile(0.95), 2),
+            "p99_ms": round(self.percentile(0.99), 2),
+        }
+
+
+class VirtualUser():
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, args: argparse.Namespace,
+                 posts: Zipf, tags: list[str], stats: dict[str, Stats]):
+        self.client = client
+        self.rng = rng
+        self.args = args
+        self.posts = posts
+        self.tags = tags
+        self.stats = stats
+        self.logged_in = False
+
+
+    async def request(self, scenario: str, method: str, url: str, ok: tuple[int, ...] = (200,),
+                      **kwargs) -> httpx.Response | None:
+        stats = self.stats.setdefault(scenario, Stats())
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        stats.latencies.append(time.perf_counter() - started)
+        if response is None or response.status_code not in ok:
+            stats.errors += 1
+        return response
+
+
+    def post_id(self) -> int:
+        return self.posts.draw(self.rng)
+
+
+    def tag(self) -> str:
+        # uniform, popular tags still weigh more through the number of posts they match
+        return self.rng.choice(self.tags)
+
+
+    # anonymous reads
+
+    async def get_posts(self):
+        await self.request("posts.get_posts", "GET", "/posts/get_posts/")
+
+    async def get_posts_by_tag(self):
+        await self.request("posts.get_posts?tag", "GET", "/posts/get_posts/", params={"tag": self.tag()})
+
+    async def get_post(self):
+        await self.request("posts.get_posts?id", "GET", "/posts/get_posts/", params={"id": self.post_id()})
+
+    async def search(self):
+        await self.request("posts.get_posts?search_query", "GET", "/posts/get_posts/",
+                           params={"search_query": self.rng.choice(WORDS)})
+
+    async def recent_posts(self):
+        await self.request("posts.recent_posts", "GET", "/posts/recent_posts/")
+
+    async def batch_posts(self):
+        await self.request("posts.batch", "GET", "/posts/batch/", params={"id": [self.post_id() for _ in range(10)]})
+
+    async def all_tags(self):
+        await self.request("posts.all_tags", "GET", "/posts/all_tags/")
+
+    async def suggest(self):
+        word = self.rng.choice(WORDS)
+        await self.request("search.suggest", "GET", "/search/suggest/", params={"q": word[:self.rng.randint(1, len(word))]})
+
+    async def get_user(self):
+        await self.request("users.get_user", "GET", f"/user/user/{self.rng.randint(1, self.args.users)}")
+
+    async def leaderboard(self):
+        await self.request("users.leaderboard", "GET", "/user/leaderboard/")
+
+    # logged in
+
+    async def login(self):
+        response = await self.request("users.login", "POST", "/user/login",
+                                      data={"username": f"user{self.rng.randint(1, self.args.users)}",
+                                            "password": SEED_PASSWORD})
+        self.logged_in = response is not None and response.status_code == 200
+
+    async def my_feed(self):
+        await self.request("posts.my_feed", "GET", "/posts/my_feed/")
+
+    async def profile(self):
+        await self.request("users.profile", "GET", "/user/profile/")
+
+    async def bookmarks(self):
+        await self.request("users.bookmarks", "GET", "/user/bookmarks/")
+
+    async def interactions(self):
+        await self.request("posts.interactions", "GET", "/posts/interactions/",
+                           params={"id": [self.post_id() for _ in range(20)]})
+
+    async def vote(self):
+        # vote and take it back, the data stays as seeded. Seeded votes make the first one a 400
+        post_id = self.post_id()
+        await self.request("posts.rate", "POST", "/posts/rate/", ok=(200, 400),
+                           json={"post_id": post_id, "value": self.rng.choice([1, -1])})
+        await self.request("posts.delete_post_rating", "DELETE", "/posts/delete_post_rating/", ok=(200, 400),
+                           json={"post_id": post_id})
+
+    async def comment(self):
+        response = await self.request("comments.create", "POST", "/comments/create/", ok=(201,),
+                                      json={"post_id": self.post_id(), "content": "load test comment"})
+        if response is not None and response.status_code == 201:
+            await self.request("comments.delete", "DELETE", "/comments/delete/",
+                               json={"comment_id": response.json()["id"]})
+
+
+    async def run(self, mix: dict[str, float], until: float):
+        anonymous = {name: weight for name, weight in mix.items() if name in ANONYMOUS}
+        if self.rng.random() < self.args.logged_in:
+            await self.login()
+        scenarios = mix if self.logged_in else anonymous
+        names, weights = list(scenarios), list(scenarios.values())
+        while time.perf_counter() < until:
+            await getattr(self, self.rng.choices(names, weights)[0])()
+            # in process a request answered from memory never suspends, the other users would starve
+            await asyncio.sleep(0)
+
+
+ANONYMOUS = {"get_posts", "get_posts_by_tag", "get_post", "search", "recent_posts", "batch_posts", "all_tags",
+             "suggest", "get_user", "leaderboard"}
+# roughly a blog: mostly browsing, some logged in reading, few writes and logins. The unfiltered
+# listings return every post, they are kept rare or they are all the run measures
+DEFAULT_MIX = {
+    "get_posts": 2, "get_posts_by_tag": 20, "get_post": 30, "search": 5, "recent_posts": 3,
+    "batch_posts": 3, "all_tags": 5, "suggest": 5, "get_user": 5, "leaderboard": 2,
+    "my_feed": 5, "profile": 3, "bookmarks": 2, "interactions": 3, "vote": 2, "comment": 1, "login": 1,
+}
+
+
+@asynccontextmanager
+async def target(url: str | None) -> AsyncIterator[Callable[[], httpx.AsyncClient]]:
+    """Clients for the server at url, or for the app run in process with its lifespan"""
+    if url:
+        yield lambda: httpx.AsyncClient(base_url=url, timeout=30)
+        return
+
+    from src.main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        yield lambda: httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30)
+
+
+def compare(results: dict, baseline: dict, max_slowdown: float, max_drop: float) -> list[str]:
+    regressions = []
+    for scenario, old in baseline["scenarios"].items():
+        new = results["scenarios"].get(scenario)
+        if new is None or not old["requests"]:
+            continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + max_slowdown):
+            regressions.append(f"{scenario}: p95 {old['p95_ms']} -> {new['p95_ms']} ms")
+        if new["rps"] < old["rps"] * (1 - max_drop):
+            regressions.append(f"{scenario}: {old['rps']} -> {new['rps']} req/s")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    mix = {**DEFAULT_MIX, **dict((name, float(weight)) for name, weight in (item.split("=") for item in args.mix))}
+    rng = random.Random(args.seed)
+    posts = popular_posts(args.seed, args.posts, args.skew)
+    stats: dict[str, Stats] = {}
+
+    async with target(args.url) as make_client:
+        async with make_client() as client:
+            tags = [tag["name"] for tag in (await client.get("/posts/all_tags/")).json()] or ["python"]
+
+        clients = [make_client() for _ in range(args.concurrency)]
+        users = [VirtualUser(client, random.Random(rng.random()), args, posts, tags, stats) for client in clients]
+        started = time.perf_counter()
+        await asyncio.gather(*(user.run(mix, started + args.duration) for user in users))
+        duration = time.perf_counter() - started
+        for client in clients:
+            await client.aclose()
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "baseline")},
+        "scenarios": {name: stats[name].summary(duration) for name in sorted(stats)},
+    }
+    print(f"{args.concurrency} virtual users for {duration:.1f} s, "
+          f"{sum(len(s.latencies) for s in stats.values()) / duration:.1f} req/s in total")
+    print(f"{'scenario':<32} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in results["scenarios"].items():
+        print(f"{name:<32} {row['requests']:>9} {row['errors']:>7} {row['rps']:>8} "
+              f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8}")
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.max_slowdown, args.max_drop)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_load", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="base url of a running server, the app runs in process without it")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=50, help="virtual users")
+    parser.add_argument("--logged-in", type=float, default=0.3, help="share of virtual users that log in")
+    parser.add_argument("--mix", nargs="*", default=[], metavar="SCENARIO=WEIGHT",
+                        help=f"override weights of the default mix, scenarios: {', '.join(DEFAULT_MIX)}")
+    parser.add_argument("--users", type=int, default=10_000, help="users seeded by tools.seed")
+    parser.add_argument("--posts", type=int, default=100_000, help="posts seeded by tools.seed")
+    parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent of post popularity")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json results to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="allowed p95 increase, 0.2 is 20%%")
+    parser.add_argument("--max-drop", type=float, default=0.2, help="allowed throughput decrease")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,94 @@
+"""
+Requests per second of the post list endpoints before and after the fast response path.
+
+Run with `python -m benchmarks.bench_responses [posts] [requests]`, no db or redis needed:
+the payload is synthetic and both apps are driven in-process through httpx.
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+from src.responses import adapter_response
+from src.schemas.posts import PostRead, post_list_adapter
+
+
+def make_posts(count: int) -> list[PostRead]:
+    now = datetime.now()
+    return [
+        PostRead(
+            id=i,
+            author_id=i % 50,
+            title=f"Post number {i}",
+            content="lorem ipsum dolor sit amet " * 40,
+            rating=i % 17,
+            created_at=now,
+            published_at=now,
+            view_count=i * 3,
+            status="public",
+            tags=[{"id": t, "name": f"tag{t}"} for t in range(3)],
+            comments=[{"id": c, "author_id": c, "content": "nice post " * 5, "post_id": i, "parent_id": None}
+                      for c in range(8)],
+        )
+        for i in range(count)
+    ]
+
+
+def baseline_app(posts: list[PostRead]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/posts", response_model=list[PostRead])
+    async def get_posts():
+        return posts
+
+    return app
+
+
+def fast_app(posts: list[PostRead], gzip: bool = False) -> FastAPI:
+    app = FastAPI(default_response_class=ORJSONResponse)
+    if gzip:
+        app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+    @app.get("/posts", response_model=list[PostRead])
+    async def get_posts():
+        return adapter_response(post_list_adapter, posts)
+
+    return app
+
+
+async def drive(app: FastAPI, requests: int, headers: dict = None) -> tuple[float, int]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/posts", headers=headers)
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = await client.get("/posts", headers=headers)
+        elapsed = time.perf_counter() - start
+    # content-length is the size on the wire, httpx hands back the decompressed body
+    return requests / elapsed, int(response.headers["content-length"])
+
+
+async def main(post_count: int, requests: int):
+    posts = make_posts(post_count)
+    cases = [
+        ("baseline (response_model + JSONResponse)", baseline_app(posts), None),
+        ("fast (TypeAdapter.dump_json)", fast_app(posts), None),
+        ("fast + gzip", fast_app(posts, gzip=True), {"Accept-Encoding": "gzip"}),
+    ]
+    print(f"{post_count} posts per response, {requests} requests per case")
+    baseline_rps = None
+    for name, app, headers in cases:
+        rps, size = await drive(app, requests, headers)
+        baseline_rps = baseline_rps or rps
+        print(f"{name:<45} {rps:>9.1f} req/s  x{rps / baseline_rps:.2f}  {size} bytes on the wire")
+
+
+if __name__ == '__main__':
+    post_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    asyncio.run(main(post_count, requests))
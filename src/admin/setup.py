@@ -1,21 +1,49 @@
-from fastapi import FastAPI, Depends
-from sqladmin import Admin
+from starlette.applications import Starlette
+from starlette.types import Receive, Scope, Send
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 
-def init_admin(app: FastAPI, engine: AsyncEngine) -> None:
-    """Initialize SQLAdmin interface"""
-    from sqladmin import Admin
-    from src.admin.views import UserAdmin, PostAdmin, TagAdmin
+class LazyAdmin():
+    """
+    ASGI app standing in for SQLAdmin until the first /admin request. Building it imports
+    sqladmin, WTForms and Jinja, which most workers never need, so it happens once, on first use
+    """
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self._app: Starlette | None = None
 
-    admin = Admin(
-        app,
-        engine,
-        title="Admin",
-        base_url="/admin",
-        templates_dir="admin/templates",
-    )
 
-    admin.add_view(UserAdmin)
-    admin.add_view(PostAdmin)
-    admin.add_view(TagAdmin)
+    @property
+    def routes(self):
+        # url_for("admin:...") resolves through the mount, only asked by admin pages once built
+        return self._app.routes if self._app is not None else []
+
+
+    def _build(self) -> Starlette:
+        from sqladmin import Admin
+        from src.admin.views import UserAdmin, PostAdmin, TagAdmin
+
+        # Admin mounts itself on the app it gets, its own starlette app is what gets served
+        admin = Admin(
+            Starlette(),
+            self.engine,
+            title="Admin",
+            base_url="/admin",
+            templates_dir="admin/templates",
+        )
+
+        admin.add_view(UserAdmin)
+        admin.add_view(PostAdmin)
+        admin.add_view(TagAdmin)
+        return admin.admin
+
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if self._app is None:
+            self._app = self._build()
+        await self._app(scope, receive, send)
+
+
+def init_admin(app: Starlette, engine: AsyncEngine) -> None:
+    """Mount the SQLAdmin interface, built lazily on its first request"""
+    app.mount("/admin", app=LazyAdmin(engine), name="admin")
@@ -1,5 +1,6 @@
 from sqladmin import ModelView
 from src.database.models import *
+from src.cache.tag_catalog import tag_catalog
 
 class UserAdmin(ModelView, model=User):
     column_list = [User.id, User.username, User.email]
@@ -11,4 +12,10 @@ class PostAdmin(ModelView, model=Post):
     column_default_sort = [("created_at", True)]
 
 class TagAdmin(ModelView, model=Tags):
-    column_list = "__all__"
\ No newline at end of file
+    column_list = "__all__"
+
+    async def after_model_change(self, data, model, is_created, request):
+        await tag_catalog.notify_changed()
+
+    async def after_model_delete(self, model, request):
+        await tag_catalog.notify_changed()
\ No newline at end of file
@@ -1,7 +1,10 @@
 from datetime import datetime, timedelta, timezone
+from hashlib import blake2b
 from typing import Optional, Annotated
+from uuid import uuid4
 import os
-from fastapi import Depends, HTTPException, status, Request
+import time
+from fastapi import Depends, HTTPException, status, Request, Response
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -12,7 +15,15 @@ from src.database.methods.user_methods import UserService
 from src.database.core import get_session
 from src.database.models.users import User, Roles
 from src.database.models.tags import Tags
-from sqlalchemy import select
+from src.database.methods.post_methods import PostService
+from src.cache.tag_catalog import tag_catalog
+from src.cache.refresh_tokens import refresh_tokens
+from src.cache.token_revocations import revoked_tokens
+from src.cache.memory import TTLCache
+from redis.exceptions import RedisError
+from sqlalchemy import select, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 
 
 
@@ -22,6 +33,13 @@ secret_key = os.getenv("SECRET_KEY")
 access_token_expire = os.getenv("ACCESS_TOKEN_EXPIRE_MINS")
 refresh_token_expire = os.getenv("REFRESH_TOKEN_EXPIRE_DAYS")
 algorithm = os.getenv("ALGORITHM")
+# create tags nobody has used yet instead of rejecting them
+auto_create_tags = os.getenv("AUTO_CREATE_TAGS", "").lower() in ("1", "true", "yes")
+# verified access token claims by token digest, entries live until the token expires
+verified_tokens = TTLCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE") or 10_000), ttl=60)
+# users resolved by get_current_user, by username. Dropped here on update and delete,
+# other workers pick the change up within the ttl
+current_users = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE") or 10_000), ttl=int(os.getenv("USER_CACHE_TTL") or 10))
 
 
 async def verify_user(username: str, password: str, session: AsyncSession):
@@ -50,22 +68,43 @@ def create_access_token(data: dict):
     encode = data.copy()
 
     expire = datetime.now(timezone.utc) + timedelta(minutes=int(access_token_expire))
-    encode.update({"expire": expire.timestamp()})
+    encode.update({"expire": expire.timestamp(), "jti": uuid4().hex})
 
     encoded_jwt = jwt.encode(encode, secret_key, algorithm=algorithm)
     return encoded_jwt
 
 
-def create_refresh_token(data: dict):
+def create_refresh_token(data: dict, jti: str = None):
     encode = data.copy()
 
     expire = datetime.now(timezone.utc) + timedelta(days=int(refresh_token_expire))
-    encode.update({"expire": expire.timestamp(), "type": "refresh"})
+    encode.update({"expire": expire.timestamp(), "type": "refresh", "jti": jti or uuid4().hex})
 
     encoded_jwt = jwt.encode(encode, secret_key, algorithm=algorithm)
     return encoded_jwt
 
 
+def refresh_token_ttl() -> int:
+    return int(refresh_token_expire) * 24 * 60 * 60
+
+
+async def issue_refresh_token(username: str, required: bool = True) -> str | None:
+    """
+    Create a refresh token and record it as live, only recorded tokens can be refreshed
+    :param required: without redis the token cant be recorded, that is a 503 unless the caller
+    can do with None and an access token alone
+    """
+    jti = uuid4().hex
+    token = create_refresh_token(data={"sub": username}, jti=jti)
+    try:
+        await refresh_tokens.register(jti, username, refresh_token_ttl())
+    except RedisError:
+        if required:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not start session")
+        return None
+    return token
+
+
 def decode_and_verify_refresh_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,11 +112,110 @@ def decode_and_verify_refresh_token(token: str):
     )
 
     payload = jwt.decode(token, secret_key, algorithms=[algorithm])
-    if payload['type'] != "refresh":
+    if payload.get('type') != "refresh" or payload.get("expire", 0) < datetime.now(timezone.utc).timestamp():
         raise credentials_exception
     return payload
 
 
+async def rotate_tokens(refresh_token: str) -> tuple[str, str, str]:
+    """
+    Spend a refresh token on a new access and refresh token pair
+    :return: username, access token, refresh token
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    try:
+        payload = decode_and_verify_refresh_token(refresh_token)
+    except JWTError:
+        raise credentials_exception
+    username, jti = payload.get("sub"), payload.get("jti")
+    if not username or not jti:
+        raise credentials_exception
+
+    new_jti = uuid4().hex
+    try:
+        new_refresh_token = await refresh_tokens.rotate(
+            jti, username, new_jti, create_refresh_token(data={"sub": username}, jti=new_jti), refresh_token_ttl())
+    except RedisError:
+        # revocation cant be checked, refuse instead of trusting the token blindly
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not refresh session")
+    if not new_refresh_token:
+        raise credentials_exception
+    return username, create_access_token(data={"sub": username}), new_refresh_token
+
+
+def set_auth_cookies(response: Response, access_token: str, refresh_token: str = None):
+    if refresh_token:
+        response.set_cookie(
+            key="refresh_token",
+            value=refresh_token,
+            httponly=True,
+            samesite="lax",
+            max_age=refresh_token_ttl(),
+        )
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=True,
+        samesite="lax",
+        max_age=int(access_token_expire) * 60
+    )
+
+
+async def verify_access_token(token: str) -> dict | None:
+    """
+    Claims of a valid, unexpired and unrevoked access token, None otherwise.
+    Signatures are checked once per token, repeats are served from verified_tokens
+    """
+    digest = blake2b(token.encode(), digest_size=16).digest()
+    now = time.time()
+    payload = verified_tokens.get(digest)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+        except JWTError:
+            return None
+        if payload.get("type") == "refresh" or payload.get("expire", 0) < now:
+            return None
+        verified_tokens.set(digest, payload, ttl=payload["expire"] - now)
+    elif payload["expire"] < now:
+        return None
+
+    if payload.get("jti") and await revoked_tokens.is_revoked(payload["jti"]):
+        return None
+    return payload
+
+
+async def access_token_subject(token: str) -> str | None:
+    """Username of a valid access token, None otherwise"""
+    payload = await verify_access_token(token)
+    return payload.get("sub") if payload else None
+
+
+def _user_snapshot(user: User) -> tuple[dict, list[tuple[int, str]]]:
+    """Column values and favorite tags, what get_current_user's callers read from the user"""
+    return ({attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs},
+            [(tag.id, tag.name) for tag in user.favorite_tags])
+
+
+async def _attach_user(session: AsyncSession, snapshot: tuple[dict, list[tuple[int, str]]]) -> User:
+    """Rebuild a cached user inside the session without a query, like verify_tags_and_convert does for tags"""
+    columns, tags = snapshot
+    favorite_tags = [Tags(id=id, name=name) for id, name in tags]
+    for tag in favorite_tags:
+        make_transient_to_detached(tag)
+    user = User(**columns)
+    set_committed_value(user, "favorite_tags", favorite_tags)
+    make_transient_to_detached(user)
+    return await session.merge(user, load=False)
+
+
+def forget_user(username: str):
+    current_users.pop(username)
+
+
 async def get_current_user(request: Request, session: AsyncSession = Depends(get_session)):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
@@ -85,28 +223,26 @@ async def get_current_user(request: Request, session: AsyncSession = Depends(get
     if not access_token and not refresh_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    if refresh_token and not access_token:
-        url = request.url.path
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            headers={"Location": f"/user/refresh/?redirect_url={url}"}
-        )
-
-    decoded_access_token = jwt.decode(access_token, secret_key, algorithms=[algorithm])
-    decoded_refresh_token = jwt.decode(refresh_token, secret_key, algorithms=[algorithm])
-    if not decoded_access_token and not decoded_refresh_token:
-        raise HTTPException(status_code=401, detail="Invalid tokens")
-
-    username = decoded_access_token.get("sub")
+    username = await access_token_subject(access_token) if access_token else None
     if not username:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-
-    async with session as session:
-        serivce = UserService(session)
-        user =  await serivce.get(by_username=username, return_raw=True)
-        if not user:
-            raise HTTPException(status_code=401, detail="User does not exist")
-        return user
+        if not refresh_token:
+            raise HTTPException(status_code=401, detail="Invalid tokens")
+        # refresh in place, the new cookies ride on whatever response this request produces
+        username, access_token, refresh_token = await rotate_tokens(refresh_token)
+        cookies = Response()
+        set_auth_cookies(cookies, access_token, refresh_token)
+        request.state.auth_cookies = [header for header in cookies.raw_headers if header[0] == b"set-cookie"]
+
+    snapshot = current_users.get(username)
+    if snapshot is not None:
+        return await _attach_user(session, snapshot)
+
+    serivce = UserService(session)
+    user =  await serivce.get(by_username=username, return_raw=True)
+    if not user:
+        raise HTTPException(status_code=401, detail="User does not exist")
+    current_users.set(username, _user_snapshot(user))
+    return user
 
 
 async def get_active_user(user: Annotated[User, Depends(get_current_user)]):
@@ -125,9 +261,19 @@ async def admin_access(user: Annotated[User, Depends(get_current_user)]):
 
 
 async def verify_tags_and_convert(session: AsyncSession, tags: list) -> list[Tags]:
-    existing_tags = (await session.scalars(select(Tags).where(Tags.name.in_(tags)))).all()
-
-    if existing_tags:
-        return existing_tags
-
-    return []
\ No newline at end of file
+    """Resolve tag names against the in-memory catalog and attach them to the session without a query"""
+    tag_ids = tag_catalog.ids_for(tags)
+
+    if auto_create_tags and len(tag_ids) < len(set(tags)):
+        tag_ids, created_tags = await PostService(session)._get_or_create_tag_ids(set(tags))
+        if created_tags:
+            await session.commit()
+            tag_catalog.add(created_tags)
+            await tag_catalog.notify_changed()
+
+    converted = []
+    for name, id in tag_ids.items():
+        tag = Tags(id=id, name=name)
+        make_transient_to_detached(tag)
+        converted.append(await session.merge(tag, load=False))
+    return converted
\ No newline at end of file
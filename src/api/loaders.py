@@ -0,0 +1,81 @@
+import asyncio
+from typing import Annotated, Awaitable, Callable, Hashable, Any
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database.core import get_session
+from src.database.methods.post_methods import PostService
+from src.database.methods.user_methods import UserService
+
+
+# upper bound of ids a client can ask for in one batch request
+MAX_BATCH_SIZE = 100
+
+class DataLoader():
+    """
+    Coalesces every load() made in the same event loop tick into a single batch call.
+    Results are memoized for the loader's lifetime, which is one request
+    """
+    def __init__(self, batch_fn: Callable[[list], Awaitable[list]]):
+        # batch_fn must return values aligned with the keys it was given, None for misses
+        self.batch_fn = batch_fn
+        self._futures: dict[Hashable, asyncio.Future] = {}
+        self._queue: list = []
+        self._task: asyncio.Task | None = None
+
+
+    def load(self, key: Hashable) -> asyncio.Future:
+        """Schedule a key for the next batch and return a future for its value"""
+        if key in self._futures:
+            return self._futures[key]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[key] = future
+        self._queue.append(key)
+        if len(self._queue) == 1:
+            loop.call_soon(self._schedule_dispatch)
+        return future
+
+
+    async def load_many(self, keys: list) -> list:
+        """Load several keys in one batch, values come back in input order"""
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+
+    def _schedule_dispatch(self):
+        self._task = asyncio.create_task(self._dispatch())
+
+
+    async def _dispatch(self):
+        keys, self._queue = self._queue, []
+        try:
+            values = await self.batch_fn(keys)
+        except Exception as err:
+            # forget failed keys so a later load can retry them
+            for key in keys:
+                self._futures.pop(key).set_exception(err)
+            return
+
+        for key, value in zip(keys, values):
+            self._futures[key].set_result(value)
+
+
+class Loaders():
+    """Request scoped set of loaders sharing one session"""
+    def __init__(self, session: AsyncSession):
+        # an AsyncSession can't run two statements at once, batches from different loaders take turns
+        self._lock = asyncio.Lock()
+        self.users = DataLoader(self._locked(UserService(session).get_many))
+        self.posts = DataLoader(self._locked(PostService(session).get_many))
+        self.tags = DataLoader(self._locked(PostService(session).get_tags_many))
+
+
+    def _locked(self, batch_fn: Callable[[list], Awaitable[list]]) -> Callable[[list], Awaitable[list]]:
+        async def wrapper(keys: list) -> list[Any]:
+            async with self._lock:
+                return await batch_fn(keys)
+        return wrapper
+
+
+async def get_loaders(session: Annotated[AsyncSession, Depends(get_session)]) -> Loaders:
+    return Loaders(session)
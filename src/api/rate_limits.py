@@ -0,0 +1,64 @@
+import math
+import os
+from typing import Literal, NamedTuple
+from fastapi import HTTPException, Request, status
+from src.api.dependencies import access_token_subject
+from src.cache.rate_limit import rate_limiter
+
+
+class RateLimit(NamedTuple):
+    capacity: int
+    per_seconds: int
+    # who shares a bucket, "user" falls back to the ip for anonymous requests
+    per: Literal["user", "ip"] = "user"
+
+
+def _rule(name: str, capacity: int, per_seconds: int, per: Literal["user", "ip"] = "user") -> RateLimit:
+    """Default rule, overridable with RATE_LIMIT_<NAME>=<requests>/<seconds>"""
+    override = os.getenv(f"RATE_LIMIT_{name.upper()}")
+    if override:
+        capacity, per_seconds = (int(part) for part in override.split("/"))
+    return RateLimit(capacity, per_seconds, per)
+
+
+RULES = {
+    # bcrypt burns ~100ms of cpu per attempt and is what credential stuffing hits
+    "login": _rule("login", 10, 60, per="ip"),
+    "register": _rule("register", 5, 60 * 60, per="ip"),
+    "search": _rule("search", 30, 60),
+    "write": _rule("write", 60, 60),
+    "import": _rule("import", 5, 60 * 60),
+}
+
+
+async def _identity(request: Request, rule: RateLimit) -> str:
+    if rule.per == "user":
+        token = request.cookies.get("access_token")
+        username = await access_token_subject(token) if token else None
+        if username:
+            return f"user:{username}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def rate_limit(name: str):
+    """Dependency enforcing the named rule, use as dependencies=[Depends(rate_limit("write"))]"""
+    rule = RULES[name]
+
+    async def check(request: Request):
+        allowed, retry_after = await rate_limiter.hit(f"{name}:{await _identity(request, rule)}",
+                                                      rule.capacity, rule.per_seconds)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+    return check
+
+
+_search_check = rate_limit("search")
+
+async def search_rate_limit(request: Request):
+    """Only full text searches are expensive, plain listings of get_posts stay unlimited"""
+    if request.query_params.get("search_query"):
+        await _search_check(request)
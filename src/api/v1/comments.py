@@ -4,6 +4,7 @@ from typing import Annotated
 from src.database.core import get_session
 from src.database.methods.comment_methods import CommentService
 from ..dependencies import get_active_user
+from ..rate_limits import rate_limit
 from src.database.models.users import User
 from ...schemas.comments import CommentRead, CreateCommentInitial, CreateCommentFinal, DeleteCommentInitial, \
     DeleteCommentFinal
@@ -11,7 +12,8 @@ from ...schemas.comments import CommentRead, CreateCommentInitial, CreateComment
 router = APIRouter(prefix="/comments", tags=["comments"])
 
 
-@router.post("/create/", response_model=CommentRead, status_code=status.HTTP_201_CREATED)
+@router.post("/create/", response_model=CommentRead, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(rate_limit("write"))])
 async def create_comment(session: Annotated[AsyncSession, Depends(get_session)], comment_data: CreateCommentInitial, user: User = Depends(get_active_user)):
     service = CommentService(session)
     try:
@@ -21,7 +23,7 @@ async def create_comment(session: Annotated[AsyncSession, Depends(get_session)],
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.delete("/delete/", status_code=status.HTTP_200_OK)
+@router.delete("/delete/", status_code=status.HTTP_200_OK, dependencies=[Depends(rate_limit("write"))])
 async def delete_comment(session: Annotated[AsyncSession, Depends(get_session)], delete_data: DeleteCommentInitial, user: User = Depends(get_active_user)):
     service = CommentService(session)
     try:
@@ -0,0 +1,50 @@
+import asyncio
+import os
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
+from src.cache.redis_config import get_redis
+from src.cache.warmer import cache_warmer
+from src.database.core import engine
+
+
+router = APIRouter(tags=["health"])
+
+# a dependency slower than this counts as down, probes run every few seconds
+HEALTH_CHECK_TIMEOUT_MS = int(os.getenv("HEALTH_CHECK_TIMEOUT_MS") or 1000)
+PROBE_PATHS = frozenset({"/healthz", "/readyz"})
+
+
+async def _database():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def _redis():
+    async with get_redis() as redis:
+        await redis.ping()
+
+
+async def _check(probe) -> bool:
+    try:
+        await asyncio.wait_for(probe(), timeout=HEALTH_CHECK_TIMEOUT_MS / 1000)
+        return True
+    except Exception:
+        return False
+
+
+@router.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness, the worker answers. Dependencies are reported but never fail it, restarting doesnt fix them"""
+    database, redis = await asyncio.gather(_check(_database), _check(_redis))
+    return {"status": "ok", "database": database, "redis": redis}
+
+
+@router.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness, only route here once the database and redis answer and the cache is warmed"""
+    database, redis = await asyncio.gather(_check(_database), _check(_redis))
+    ready = database and redis and cache_warmer.warmed
+    return ORJSONResponse({"status": "ready" if ready else "unavailable", "database": database,
+                           "redis": redis, "warmed": cache_warmer.warmed},
+                          status_code=200 if ready else 503)
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from src.cache.circuit_breaker import cache_breaker, BreakerState
+
+
+router = APIRouter(tags=["metrics"])
+
+BREAKERS = (cache_breaker,)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Process local counters in prometheus text format, scrape every worker"""
+    lines = ["# TYPE circuit_breaker_state gauge"]
+    for breaker in BREAKERS:
+        for state in BreakerState:
+            lines.append(f'circuit_breaker_state{{name="{breaker.name}",state="{state}"}} {int(breaker.state == state)}')
+    lines.append("# TYPE circuit_breaker_events_total counter")
+    for breaker in BREAKERS:
+        for event, count in breaker.counters.items():
+            lines.append(f'circuit_breaker_events_total{{name="{breaker.name}",event="{event}"}} {count}')
+    return PlainTextResponse("\n".join(lines) + "\n")
@@ -1,21 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from redis.exceptions import RedisError
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, Optional
 from starlette.requests import Request
-from src.database.core import get_session
+from src.database.core import get_session, get_db
 from src.schemas.posts import PostCreateInitial, PostCreateFinal, PostRead, PostUpdateInitial, \
     PostUpdateFinal, PostDeleteInitial, PostDeleteFinal, RatePostInitial, RatePostFinal, DeletePostRatingFinal, \
-    DeletePostRatingInitial
+    DeletePostRatingInitial, Tag, post_list_adapter, PostImport, post_batch_adapter, TagStats, tag_stats_list_adapter, \
+    PostInteraction, post_interaction_list_adapter
 from src.database.methods.post_methods import PostService
-from ..dependencies import get_active_user, verify_tags_and_convert
-from src.database.models.users import User
-from src.cache.redis_utils import generate_cache_key, get_cache, set_cache, delete_caches
+from src.database.methods.deletion_methods import DeletionService
+from ..dependencies import get_active_user, verify_tags_and_convert, admin_access
+from ..loaders import Loaders, get_loaders, MAX_BATCH_SIZE
+from ..rate_limits import rate_limit, search_rate_limit
+from src.database.models.users import User, Roles
+from src.schemas.users import DeletionProgress
+from src.cache.redis_utils import generate_cache_key, cache_key, cached, CachePolicy
+from src.cache.warmer import cache_warmer
+from starlette.datastructures import QueryParams
+from src.cache.tag_catalog import tag_catalog
+from src.cache.tag_stats import tag_stats
+from src.cache.interactions import interaction_cache
+from src.jobs import queue
+from src.responses import raw_json_response, adapter_response
+from src.utils import iter_lines
 
 
 router = APIRouter(prefix="/posts", tags=["posts"])
 
+CACHE_NAMESPACE = "posts"
+# own key prefix inside the namespace, an unfiltered get_posts hashes the same empty query
+RECENT_POSTS_KEYS = f"{CACHE_NAMESPACE}:recent"
+# recent_posts takes no parameters, a query string appended to it must not make a new entry
+RECENT_POSTS_QUERY = QueryParams()
+GET_POSTS_CACHE = CachePolicy.from_env("get_posts", soft_ttl=60, hard_ttl=60 * 60)
+RECENT_POSTS_CACHE = CachePolicy.from_env("recent_posts", soft_ttl=30, hard_ttl=60 * 60)
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_IMPORT_ERRORS = 100
 
-@router.post("/create/", response_model=PostRead, status_code=status.HTTP_201_CREATED)
+
+def get_posts_loader(params: QueryParams):
+    id = int(params["id"]) if params.get("id") else None
+    tags, search_query = params.getlist("tag"), params.get("search_query")
+
+    async def load(session: AsyncSession) -> bytes:
+        return post_list_adapter.dump_json(await PostService(session).get_posts(id, tags, search_query))
+    return load
+
+
+def recent_posts_loader(params: QueryParams):
+    async def load(session: AsyncSession) -> bytes:
+        return post_list_adapter.dump_json(await PostService(session).get_posts(order='newest'))
+    return load
+
+
+cache_warmer.register("get_posts", CACHE_NAMESPACE, GET_POSTS_CACHE, get_posts_loader)
+cache_warmer.register("recent_posts", CACHE_NAMESPACE, RECENT_POSTS_CACHE, recent_posts_loader,
+                      key_prefix=RECENT_POSTS_KEYS)
+
+
+@router.post("/cache/warm/", status_code=status.HTTP_200_OK)
+async def warm_cache(is_admin = Depends(admin_access),
+                     top: int = Query(50, ge=1, le=1000)):
+    warmed = await cache_warmer.warm(top=top)
+    return {"warmed": warmed}
+
+
+@router.post("/create/", response_model=PostRead, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(rate_limit("write"))])
 async def create_post(post_data: PostCreateInitial,
                       request: Request,
                       session: Annotated[AsyncSession, Depends(get_session)],
@@ -34,35 +88,58 @@ async def create_post(post_data: PostCreateInitial,
         post_serve_data = PostCreateFinal(**data, author_id=author_id)
         post = await service.create_post(post_serve_data)
 
-        pattern = f"cache:{request.scope['router']}:*"
-        await delete_caches(pattern)
+        await queue.enqueue("cache.mark_stale", namespace=CACHE_NAMESPACE)
 
         return post
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.get("/get_posts/", status_code=status.HTTP_200_OK, response_model=list[PostRead])
+@router.get("/get_posts/", status_code=status.HTTP_200_OK, response_model=list[PostRead],
+            dependencies=[Depends(search_rate_limit)])
 async def get_post(session: Annotated[AsyncSession, Depends(get_session)],
                    request: Request,
                    id: int = None,
                    search_query: str = None,
                    tags: Optional[list[str]] = Query([], alias="tag", example=["Python", "JavaScript"]),
                    ):
-    key = generate_cache_key(request)
+    key = generate_cache_key(request, CACHE_NAMESPACE)
     try:
-        cache = await get_cache(key)
-        if cache:
-            return cache
-        service = PostService(session)
-        post = await service.get_posts(id, tags, search_query)
-        await set_cache(key, post)
-        return post
+        body = await cached(key, CACHE_NAMESPACE, session, get_posts_loader(request.query_params), GET_POSTS_CACHE)
+        cache_warmer.record("get_posts", request.query_params)
+        return raw_json_response(body)
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.patch("/update/", response_model=PostRead, status_code=status.HTTP_200_OK)
+@router.get("/batch/", status_code=status.HTTP_200_OK, response_model=list[Optional[PostRead]])
+async def batch_posts(loaders: Annotated[Loaders, Depends(get_loaders)],
+                      ids: list[int] = Query(..., alias="id")):
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} ids per request")
+
+    posts = await loaders.posts.load_many(ids)
+    return adapter_response(post_batch_adapter, posts)
+
+
+@router.get("/interactions/", status_code=status.HTTP_200_OK, response_model=list[PostInteraction])
+async def interactions(session: Annotated[AsyncSession, Depends(get_session)],
+                       background_tasks: BackgroundTasks,
+                       user: User = Depends(get_active_user),
+                       ids: list[int] = Query(..., alias="id")):
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} ids per request")
+
+    result = await interaction_cache.lookup(user.id, ids)
+    if result is None:
+        service = PostService(session)
+        result = await service.interactions(user.id, ids)
+        background_tasks.add_task(interaction_cache.warm, user.id)
+    return adapter_response(post_interaction_list_adapter, result)
+
+
+@router.patch("/update/", response_model=PostRead, status_code=status.HTTP_200_OK,
+              dependencies=[Depends(rate_limit("write"))])
 async def update_post(update_data: PostUpdateInitial,
                       request: Request,
                       session: Annotated[AsyncSession,Depends(get_session)],
@@ -78,17 +155,15 @@ async def update_post(update_data: PostUpdateInitial,
             data['tags'] = processed_tags
 
         new_data = PostUpdateFinal(**data, author_id=user_id)
-
-        pattern = f"cache:{request.scope['router']}:*"
-        await delete_caches(pattern)
-
         result = await service.update_post(new_data)
+
+        await queue.enqueue("cache.mark_stale", namespace=CACHE_NAMESPACE)
         return result
     except ValueError as err:
         raise HTTPException(status_code=400, detail=err)
 
 
-@router.delete("/delete/", status_code=status.HTTP_200_OK)
+@router.delete("/delete/", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(rate_limit("write"))])
 async def delete_post(session: Annotated[AsyncSession, Depends(get_session)],
                       request: Request,
                       delete_data: PostDeleteInitial,
@@ -96,36 +171,52 @@ async def delete_post(session: Annotated[AsyncSession, Depends(get_session)],
     service = PostService(session)
     try:
         final_delete_data = PostDeleteFinal(id=delete_data.id, author_id=user.id)
+        await service.delete_post(final_delete_data)
 
-        pattern = f"cache:{request.scope['router']}:*"
-        await delete_caches(pattern)
-
-        return await service.delete_post(final_delete_data)
+        # serving a deleted post while revalidating is not acceptable, drop the entries
+        await queue.enqueue("cache.purge", namespace=CACHE_NAMESPACE)
+        return {"status": "scheduled"}
     except ValueError as err:
         raise HTTPException(status_code=400, detail=err)
 
 
-@router.get("/recent_posts/", status_code=status.HTTP_200_OK)
+@router.get("/deletion/{id}/", response_model=DeletionProgress, status_code=status.HTTP_200_OK)
+async def post_deletion_progress(id: int,
+                                 session: Annotated[AsyncSession, Depends(get_session)],
+                                 user: User = Depends(get_active_user)):
+    service = DeletionService(session)
+    progress = await service.progress("post", id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No deletion scheduled")
+    if user.role != Roles.ADMIN and await service.owner("post", id) != user.id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not your post!")
+    return progress
+
+
+@router.get("/recent_posts/", status_code=status.HTTP_200_OK, response_model=list[PostRead])
 async def recent_posts(session: Annotated[AsyncSession, Depends(get_session)]):
-    service = PostService(session)
+    key = cache_key(RECENT_POSTS_KEYS, RECENT_POSTS_QUERY)
     try:
-        return await service.get_posts(order='newest')
+        body = await cached(key, CACHE_NAMESPACE, session, recent_posts_loader(RECENT_POSTS_QUERY), RECENT_POSTS_CACHE)
+        cache_warmer.record("recent_posts", RECENT_POSTS_QUERY)
+        return raw_json_response(body)
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.get("/my_feed/", status_code=status.HTTP_200_OK)
+@router.get("/my_feed/", status_code=status.HTTP_200_OK, response_model=list[PostRead])
 async def my_feed(session: Annotated[AsyncSession, Depends(get_session)],
                   user: User = Depends(get_active_user)):
     service = PostService(session)
     try:
         converted_tags = [tag.name for tag in user.favorite_tags]
-        return await service.get_posts(order='newest', tags=converted_tags)
+        posts = await service.get_posts(order='newest', tags=converted_tags)
+        return adapter_response(post_list_adapter, posts)
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.post("/rate/", status_code=status.HTTP_200_OK)
+@router.post("/rate/", status_code=status.HTTP_200_OK, dependencies=[Depends(rate_limit("write"))])
 async def rate_post(session: Annotated[AsyncSession, Depends(get_session)],
                     rating_data: RatePostInitial,
                     user: User = Depends(get_active_user)):
@@ -137,7 +228,8 @@ async def rate_post(session: Annotated[AsyncSession, Depends(get_session)],
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.delete("/delete_post_rating/", status_code=status.HTTP_200_OK)
+@router.delete("/delete_post_rating/", status_code=status.HTTP_200_OK,
+               dependencies=[Depends(rate_limit("write"))])
 async def delete_post_rating(session: Annotated[AsyncSession, Depends(get_session)],
                              rating_data: DeletePostRatingInitial,
                              user: User = Depends(get_active_user)):
@@ -149,7 +241,7 @@ async def delete_post_rating(session: Annotated[AsyncSession, Depends(get_sessio
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.post("/bookmarks/", status_code=status.HTTP_200_OK)
+@router.post("/bookmarks/", status_code=status.HTTP_200_OK, dependencies=[Depends(rate_limit("write"))])
 async def bookmarks(session: Annotated[AsyncSession, Depends(get_session)],
                     user: User = Depends(get_active_user),
                     post_id: int = Body(..., embed=True)):
@@ -160,7 +252,60 @@ async def bookmarks(session: Annotated[AsyncSession, Depends(get_session)],
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.get("/all_tags/", status_code=status.HTTP_200_OK)
-async def all_tags(session: Annotated[AsyncSession, Depends(get_session)]):
+@router.get("/all_tags/", status_code=status.HTTP_200_OK, response_model=list[Tag])
+async def all_tags():
+    return raw_json_response(tag_catalog.encoded)
+
+
+@router.get("/tags/stats/", status_code=status.HTTP_200_OK, response_model=list[TagStats])
+async def tags_stats():
+    try:
+        stats = await tag_stats.all()
+    except RedisError:
+        # counts live in redis only, the catalog still lists every tag
+        stats = [TagStats(id=tag.id, name=tag.name) for tag in tag_catalog.all()]
+    return adapter_response(tag_stats_list_adapter, stats)
+
+
+@router.get("/export/", status_code=status.HTTP_200_OK)
+async def export_posts(is_admin = Depends(admin_access)):
+    async def stream():
+        # the request scoped session is closed before a streaming body is sent, so own one here
+        async with get_db() as session:
+            async for batch in PostService(session).export_posts():
+                yield batch
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post("/import/", status_code=status.HTTP_201_CREATED, dependencies=[Depends(rate_limit("import"))])
+async def import_posts(request: Request,
+                       session: Annotated[AsyncSession, Depends(get_session)],
+                       is_admin = Depends(admin_access)):
     service = PostService(session)
-    return await service._get_all_tags()
\ No newline at end of file
+    imported, failed, errors, chunk = 0, 0, [], []
+    line_number = 0
+    try:
+        async for line in iter_lines(request.stream()):
+            line_number += 1
+            try:
+                chunk.append(PostImport.model_validate_json(line))
+            except ValidationError as err:
+                failed += 1
+                if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+                    errors.append({"line": line_number, "detail": str(err)})
+                continue
+
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                imported += await service.import_posts(chunk)
+                chunk = []
+
+        if chunk:
+            imported += await service.import_posts(chunk)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=f"{err} (line {line_number}, {imported} posts imported before it)")
+    finally:
+        if imported:
+            await queue.enqueue("cache.mark_stale", namespace=CACHE_NAMESPACE)
+
+    return {"imported": imported, "failed": failed, "errors": errors}
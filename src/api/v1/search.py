@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated
+from src.cache.memory import TTLCache
+from src.database.core import get_session
+from src.database.methods.search_methods import SearchService
+from src.responses import raw_json_response
+from src.schemas.search import Suggestions
+from ..rate_limits import rate_limit
+
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+SUGGEST_LIMIT = 5
+# shorter prefixes match most of the trigram index, they are answered from the tag trie only
+MIN_DB_PREFIX = 3
+# typeahead hammers the same few prefixes, a short ttl keeps them fresh enough
+hot_prefixes = TTLCache(maxsize=4096, ttl=10)
+
+
+@router.get("/suggest/", response_model=Suggestions, status_code=status.HTTP_200_OK,
+            dependencies=[Depends(rate_limit("search"))])
+async def suggest(session: Annotated[AsyncSession, Depends(get_session)],
+                  q: str = Query(..., min_length=1, max_length=50)):
+    key = q.strip().lower()
+    if not key:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Query is blank")
+    body = hot_prefixes.get(key)
+    if body is None:
+        if len(key) < MIN_DB_PREFIX:
+            suggestions = Suggestions(tags=SearchService.tag_prefixes(key, limit=SUGGEST_LIMIT))
+        else:
+            suggestions = await SearchService(session).suggest(key, limit=SUGGEST_LIMIT)
+        body = suggestions.model_dump_json().encode()
+        hot_prefixes.set(key, body)
+    return raw_json_response(body)
@@ -1,15 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, Form
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Annotated
+from typing import Annotated, Optional
 from starlette.responses import RedirectResponse
 from src.database.core import get_session
-from src.schemas.users import UserCreate, UserRead, UserUpdateFinal, UserDelete, UserUpdateInitial, Profile
+from src.schemas.users import UserCreate, UserRead, UserUpdateFinal, UserDelete, UserUpdateInitial, Profile, \
+    user_batch_adapter, AuthorStats, author_stats_list_adapter, DeletionProgress
 from src.database.methods.user_methods import UserService
-from ..dependencies import verify_user, create_access_token, verify_user_for_refresh, get_active_user, \
-    verify_tags_and_convert, create_refresh_token, decode_and_verify_refresh_token, admin_access
+from src.database.methods.deletion_methods import DeletionService
+from src.database.methods.stats_methods import AuthorStatsService
+from ..dependencies import verify_user, create_access_token, get_active_user, verify_tags_and_convert, \
+    admin_access, issue_refresh_token, rotate_tokens, set_auth_cookies, verify_access_token, secret_key, algorithm, \
+    forget_user
+from src.cache.refresh_tokens import refresh_tokens
+from src.cache.token_revocations import revoked_tokens
 from src.database.models.users import User
-from ...schemas.posts import PostRead
+from ...schemas.posts import PostRead, PostPage, post_list_adapter
+from ...responses import adapter_response, raw_json_response
+from ..loaders import Loaders, get_loaders, MAX_BATCH_SIZE
+from ..rate_limits import rate_limit
 from jose import jwt, JWTError
+from redis.exceptions import RedisError
 from ...utils import hash_password
 
 
@@ -21,37 +31,22 @@ router = APIRouter(prefix="/user", tags=["users"])
 async def refresh_token(request: Request,
                         session: Annotated[AsyncSession, Depends(get_session)],
                         redirect_url: str):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-    )
-    try:
-        token = request.cookies.get("refresh_token")
-        payload = decode_and_verify_refresh_token(token)
-        username = payload.get('sub')
-        if not username:
-            raise credentials_exception
-
-        user = await verify_user_for_refresh(username, session)
-        if not user:
-            raise credentials_exception
-
-        response = RedirectResponse(redirect_url)
-        access_token = create_access_token(data={"sub": username})
-        response.set_cookie(
-            key="access_token",
-            value=access_token,
-            httponly=True,
-            samesite="lax",
-            max_age=30 * 60
-        )
+    """Explicit refresh for clients that want one, authenticated endpoints refresh inline"""
+    token = request.cookies.get("refresh_token")
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
 
-        return response
-    except JWTError:
-        raise credentials_exception
+    username, access_token, new_refresh_token = await rotate_tokens(token)
+    user = await UserService(session).get(by_username=username, return_raw=True)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+
+    response = RedirectResponse(redirect_url)
+    set_auth_cookies(response, access_token, new_refresh_token)
+    return response
 
 
-@router.post("/register/")
+@router.post("/register/", dependencies=[Depends(rate_limit("register"))])
 async def register(session: Annotated[AsyncSession, Depends(get_session)],
                    user_data: UserCreate
                    ):
@@ -63,7 +58,7 @@ async def register(session: Annotated[AsyncSession, Depends(get_session)],
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(rate_limit("login"))])
 async def login_for_access_token(session: Annotated[AsyncSession, Depends(get_session)],
                                  response: Response,
                                  username: str = Form(...),
@@ -75,34 +70,31 @@ async def login_for_access_token(session: Annotated[AsyncSession, Depends(get_se
             detail="Incorrect username or password",
         )
 
-    refesh_token = create_refresh_token(
-        data={"sub": user.username}
-    )
-    response.set_cookie(
-        key="refresh_token",
-        value=refesh_token,
-        httponly=True,
-        samesite="lax",
-        max_age=7*24*60*60,
-    )
-
+    refesh_token = await issue_refresh_token(user.username)
     access_token = create_access_token(
         data={"sub": user.username}
     )
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        samesite="lax",
-        max_age=30*60
-    )
+    set_auth_cookies(response, access_token, refesh_token)
 
     return {"access_token": access_token, "refresh_token": refesh_token}
 
 
 @router.post("/logout/", status_code=status.HTTP_200_OK)
-async def logout(response: Response,
+async def logout(request: Request,
+                 response: Response,
                  user: User = Depends(get_active_user)):
+    try:
+        access = await verify_access_token(request.cookies.get("access_token", ""))
+        if access and access.get("jti"):
+            await revoked_tokens.revoke(access["jti"], access["expire"])
+        refresh = jwt.decode(request.cookies.get("refresh_token", ""), secret_key, algorithms=[algorithm])
+        if refresh.get("jti"):
+            await refresh_tokens.revoke(refresh["jti"], user.username)
+    except (JWTError, RedisError):
+        # the cookies go away regardless, an unrevoked token just lives out its ttl
+        pass
+    # a refresh made by this very request must not hand the session back
+    request.state.auth_cookies = None
     response.delete_cookie("access_token")
     response.delete_cookie("refresh_token")
 
@@ -116,7 +108,8 @@ async def profile(session: Annotated[AsyncSession, Depends(get_session)],
     return await service.profile(user.id)
 
 
-@router.post("/create/", response_model=UserRead, status_code=status.HTTP_201_CREATED)
+@router.post("/create/", response_model=UserRead, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(rate_limit("register"))])
 async def create_user(user_create: UserCreate,
                       response: Response,
                       session: Annotated[AsyncSession, Depends(get_session)]):
@@ -126,27 +119,12 @@ async def create_user(user_create: UserCreate,
         user_create.password = hashed_password
         created_user = await service.create(user_create)
 
-        refesh_token = create_refresh_token(
-            data={"sub": created_user.username}
-        )
-        response.set_cookie(
-            key="refresh_token",
-            value=refesh_token,
-            httponly=True,
-            samesite="lax",
-            max_age=7 * 24 * 60 * 60,
-        )
-
+        # the account is committed by now, without redis the client gets a short session and logs in later
+        refesh_token = await issue_refresh_token(created_user.username, required=False)
         access_token = create_access_token(
             data={"sub": created_user.username}
         )
-        response.set_cookie(
-            key="access_token",
-            value=access_token,
-            httponly=True,
-            samesite="lax",
-            max_age=30 * 60
-        )
+        set_auth_cookies(response, access_token, refesh_token)
         return created_user
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
@@ -154,11 +132,14 @@ async def create_user(user_create: UserCreate,
 
 @router.get("/user/{id}", response_model=UserRead, status_code=status.HTTP_200_OK)
 async def get_user(id: str | int,
-                   session: Annotated[AsyncSession, Depends(get_session)]):
+                   session: Annotated[AsyncSession, Depends(get_session)],
+                   loaders: Annotated[Loaders, Depends(get_loaders)]):
     service = UserService(session)
     try:
         if id.isdigit():
-            user = await service.get(by_id=int(id))
+            user = await loaders.users.load(int(id))
+            if user is None:
+                raise HTTPException(status_code=404, detail="User doesnt exist")
         else:
             user = await service.get(by_username=id)
         return user
@@ -166,7 +147,18 @@ async def get_user(id: str | int,
         raise HTTPException(status_code=400, detail=str(err))
 
 
-@router.patch("/update/", response_model=UserRead, status_code=status.HTTP_200_OK)
+@router.get("/batch/", response_model=list[Optional[UserRead]], status_code=status.HTTP_200_OK)
+async def batch_users(loaders: Annotated[Loaders, Depends(get_loaders)],
+                      ids: list[int] = Query(..., alias="id")):
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} ids per request")
+
+    users = await loaders.users.load_many(ids)
+    return adapter_response(user_batch_adapter, users)
+
+
+@router.patch("/update/", response_model=UserRead, status_code=status.HTTP_200_OK,
+              dependencies=[Depends(rate_limit("write"))])
 async def update_user(user_data: UserUpdateInitial,
                       session: Annotated[AsyncSession, Depends(get_session)],
                       user: User = Depends(get_active_user)):
@@ -175,12 +167,13 @@ async def update_user(user_data: UserUpdateInitial,
         user_id = user.id
         update_data = UserUpdateFinal(**user_data.model_dump(), id=user_id)
         new_user = await service.update(update_data)
+        forget_user(user.username)
         return new_user
     except ValueError as err:
         raise HTTPException(status_code=200, detail=str(err))
 
 
-@router.post("/favorite_tag/", status_code=status.HTTP_200_OK)
+@router.post("/favorite_tag/", status_code=status.HTTP_200_OK, dependencies=[Depends(rate_limit("write"))])
 async def favorite_tag(session: Annotated[AsyncSession, Depends(get_session)],
                        user: User = Depends(get_active_user),
                        tags: list[str] = Query(..., alias="tag")):
@@ -190,25 +183,68 @@ async def favorite_tag(session: Annotated[AsyncSession, Depends(get_session)],
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect tag names")
 
     result = await service.add_tag_to_favorites(user_id=user.id, tags=processed_tags)
+    forget_user(user.username)
     if result:
         return {"status": "success"}
     return {"status": "failed"}
 
 
-@router.delete("/delete/", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/delete/", status_code=status.HTTP_202_ACCEPTED)
 async def delete_user(user_data: UserDelete,
                       session: Annotated[AsyncSession, Depends(get_session)],
                       is_admin = Depends(admin_access)):
     service = UserService(session)
     try:
-        deleted = await service.delete(user_data.id, user_data.password)
-        return {"user_deleted?": deleted}
+        username = await service.delete(user_data.id, user_data.password)
+        forget_user(username)
+        return {"status": "scheduled"}
     except ValueError as err:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(err))
 
 
+@router.get("/deletion/{id}/", response_model=DeletionProgress, status_code=status.HTTP_200_OK)
+async def user_deletion_progress(id: int,
+                                 session: Annotated[AsyncSession, Depends(get_session)],
+                                 is_admin = Depends(admin_access)):
+    service = DeletionService(session)
+    progress = await service.progress("user", id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No deletion scheduled")
+    return progress
+
+
 @router.get("/my_posts/", response_model=list[PostRead], status_code=status.HTTP_200_OK)
 async def my_posts(session: Annotated[AsyncSession, Depends(get_session)],
                    user: User = Depends(get_active_user)):
     service = UserService(session)
-    return await service.user_posts(user_id=user.id)
\ No newline at end of file
+    posts = await service.user_posts(user_id=user.id)
+    return adapter_response(post_list_adapter, posts)
+
+
+@router.get("/bookmarks/", response_model=PostPage, status_code=status.HTTP_200_OK)
+async def bookmarks(session: Annotated[AsyncSession, Depends(get_session)],
+                    user: User = Depends(get_active_user),
+                    cursor: Optional[int] = None,
+                    limit: int = Query(20, ge=1, le=100)):
+    service = UserService(session)
+    page = await service.bookmarked_posts(user_id=user.id, cursor=cursor, limit=limit)
+    return raw_json_response(page.model_dump_json().encode())
+
+
+@router.get("/leaderboard/", response_model=list[AuthorStats], status_code=status.HTTP_200_OK)
+async def leaderboard(session: Annotated[AsyncSession, Depends(get_session)],
+                      limit: int = Query(20, ge=1, le=100),
+                      offset: int = Query(0, ge=0)):
+    service = AuthorStatsService(session)
+    stats = await service.leaderboard(limit=limit, offset=offset)
+    return adapter_response(author_stats_list_adapter, stats)
+
+
+@router.get("/{id}/stats/", response_model=AuthorStats, status_code=status.HTTP_200_OK)
+async def user_stats(id: int,
+                     session: Annotated[AsyncSession, Depends(get_session)]):
+    service = AuthorStatsService(session)
+    stats = await service.get(id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="User doesnt exist")
+    return stats
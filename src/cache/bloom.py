@@ -0,0 +1,39 @@
+import math
+from hashlib import blake2b
+
+
+class BloomFilter():
+    """
+    Fixed size set membership with no false negatives. Members cant be removed,
+    rebuild the filter to forget them
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+
+    def _positions(self, item: bytes):
+        # double hashing, k positions out of two 64 bit halves of one digest
+        digest = blake2b(item, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+
+    def add(self, item: str | bytes):
+        if isinstance(item, str):
+            item = item.encode()
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+    def __contains__(self, item: str | bytes) -> bool:
+        if isinstance(item, str):
+            item = item.encode()
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+    def __len__(self):
+        return self.count
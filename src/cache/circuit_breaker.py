@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import time
+from enum import StrEnum
+from typing import Any, Awaitable, Callable
+from redis.exceptions import RedisError
+
+
+logger = logging.getLogger(__name__)
+
+# a cache read slower than this costs more than going to the db
+CACHE_TIMEOUT_MS = int(os.getenv("CACHE_TIMEOUT_MS") or 50)
+CACHE_FAILURE_THRESHOLD = int(os.getenv("CACHE_FAILURE_THRESHOLD") or 5)
+CACHE_RESET_TIMEOUT = int(os.getenv("CACHE_RESET_TIMEOUT") or 10)
+
+
+class BreakerState(StrEnum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker():
+    """
+    Stops calling redis after failure_threshold consecutive failures or timeouts. While open every
+    call returns the fallback at once, after reset_timeout a single probe is let through and its
+    outcome closes or reopens the circuit
+    """
+    def __init__(self, name: str, timeout: float = CACHE_TIMEOUT_MS / 1000,
+                 failure_threshold: int = CACHE_FAILURE_THRESHOLD, reset_timeout: float = CACHE_RESET_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.counters = {"calls": 0, "failures": 0, "timeouts": 0, "short_circuited": 0, "opened": 0}
+
+
+    def _allow(self) -> bool:
+        if self.state == BreakerState.CLOSED:
+            return True
+        if self.state == BreakerState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._transition(BreakerState.HALF_OPEN)
+        if self.state == BreakerState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+
+    async def call(self, fn: Callable[..., Awaitable], *args, fallback: Any = None, **kwargs) -> Any:
+        """Await fn within the timeout, the fallback is returned when it fails or the circuit is open"""
+        if not self._allow():
+            self.counters["short_circuited"] += 1
+            return fallback
+
+        self.counters["calls"] += 1
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout=self.timeout)
+        except (RedisError, OSError, asyncio.TimeoutError) as err:
+            self.counters["timeouts" if isinstance(err, asyncio.TimeoutError) else "failures"] += 1
+            self._on_failure()
+            return fallback
+        finally:
+            # a probe cancelled with its request or failing otherwise must not keep the circuit half open for good
+            self._probing = False
+        self._on_success()
+        return result
+
+
+    def _on_success(self):
+        self.failures = 0
+        if self.state != BreakerState.CLOSED:
+            self._transition(BreakerState.CLOSED)
+
+
+    def _on_failure(self):
+        self.failures += 1
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != BreakerState.OPEN:
+                self.counters["opened"] += 1
+                self._transition(BreakerState.OPEN)
+
+
+    def _transition(self, state: BreakerState):
+        logger.warning("Circuit %s %s -> %s", self.name, self.state, state)
+        self.state = state
+
+
+    def metrics(self) -> dict[str, int | str]:
+        return {"state": str(self.state), **self.counters}
+
+
+cache_breaker = CircuitBreaker("cache")
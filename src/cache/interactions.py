@@ -0,0 +1,156 @@
+import logging
+import os
+from redis.exceptions import RedisError
+from src.cache.redis_config import get_redis
+from src.database.core import get_db
+from src.schemas.posts import PostInteraction
+
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("INTERACTION_CACHE", "1").lower() not in ("0", "false", "no")
+TTL = int(os.getenv("INTERACTION_CACHE_TTL") or 60 * 60)
+
+# refuses to fill if a write bumped the version after the snapshot was read from the db
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[4]) or '0') ~= ARGV[1] then return 0 end
+redis.call('DEL', KEYS[2], KEYS[3])
+local votes = tonumber(ARGV[3])
+for i = 4, 3 + 2 * votes, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+for i = 4 + 2 * votes, #ARGV do
+    redis.call('SADD', KEYS[3], ARGV[i])
+end
+redis.call('SET', KEYS[1], 1, 'EX', ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[2])
+return 1
+"""
+
+# applies a write to a filled cache and invalidates any fill that is still in flight
+UPDATE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call(ARGV[2], KEYS[3], unpack(ARGV, 3))
+end
+return 1
+"""
+
+# forgets a purged post in one user's cache, the version bump invalidates fills that still saw it
+REMOVE_POST_SCRIPT = """
+redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    redis.call('SREM', KEYS[3], ARGV[2])
+end
+return 1
+"""
+
+
+class InteractionCache():
+    """
+    Per user redis copy of voted (hash post_id -> value) and bookmarked (set) post ids,
+    so rendering interaction state for a page of posts needs no db round trip
+    """
+    @staticmethod
+    def _keys(user_id: int) -> tuple[str, str, str, str]:
+        base = f"interactions:{user_id}"
+        return f"{base}:ready", f"{base}:votes", f"{base}:bookmarks", f"{base}:version"
+
+
+    async def lookup(self, user_id: int, post_ids: list[int]) -> list[PostInteraction] | None:
+        """Interaction state for the posts in input order, None when the user isn't cached"""
+        if not ENABLED:
+            return None
+
+        ready, votes, bookmarks, _ = self._keys(user_id)
+        try:
+            async with get_redis() as redis:
+                is_ready, values, bookmarked = await (redis.pipeline(transaction=False)
+                    .exists(ready).hmget(votes, post_ids).smismember(bookmarks, post_ids)
+                    .execute())
+        except RedisError:
+            return None
+
+        if not is_ready:
+            return None
+        return [PostInteraction(post_id=post_id, vote=int(value) if value is not None else None, bookmarked=bool(flag))
+                for post_id, value, flag in zip(post_ids, values, bookmarked)]
+
+
+    async def warm(self, user_id: int):
+        """Load every vote and bookmark of the user into redis, meant to run after the response"""
+        if not ENABLED:
+            return
+        from src.database.methods.post_methods import PostService
+
+        ready, votes, bookmarks, version = self._keys(user_id)
+        try:
+            async with get_redis() as redis:
+                expected = (await redis.get(version) or b"0").decode()
+                async with get_db() as session:
+                    user_votes, user_bookmarks = await PostService(session).user_interactions(user_id)
+
+                args = [expected, TTL, len(user_votes)]
+                for post_id, value in user_votes.items():
+                    args += [post_id, value]
+                args += list(user_bookmarks)
+                await redis.eval(FILL_SCRIPT, 4, ready, votes, bookmarks, version, *args)
+        except RedisError:
+            logger.warning("Could not warm interaction cache of user %s", user_id)
+
+
+    async def vote_changed(self, user_id: int, post_id: int, value: int | None):
+        """Mirror a new or removed vote"""
+        if value is None:
+            await self._update(user_id, "votes", "HDEL", post_id)
+        else:
+            await self._update(user_id, "votes", "HSET", post_id, value)
+
+
+    async def bookmark_changed(self, user_id: int, post_id: int, bookmarked: bool):
+        """Mirror an added or removed bookmark"""
+        await self._update(user_id, "bookmarks", "SADD" if bookmarked else "SREM", post_id)
+
+
+    async def post_removed(self, post_id: int, user_ids: set[int]):
+        """Drop a purged post from the caches of the users who voted on or bookmarked it"""
+        if not ENABLED or not user_ids:
+            return
+        try:
+            async with get_redis() as redis:
+                pipe = redis.pipeline(transaction=False)
+                for user_id in user_ids:
+                    pipe.eval(REMOVE_POST_SCRIPT, 4, *self._keys(user_id), TTL, post_id)
+                await pipe.execute()
+        except RedisError:
+            logger.warning("Could not remove post %s from interaction caches, dropping them", post_id)
+            try:
+                async with get_redis() as redis:
+                    await redis.delete(*(self._keys(user_id)[0] for user_id in user_ids))
+            except RedisError:
+                pass
+
+
+    async def _update(self, user_id: int, target: str, command: str, *args):
+        if not ENABLED:
+            return
+        ready, votes, bookmarks, version = self._keys(user_id)
+        try:
+            async with get_redis() as redis:
+                await redis.eval(UPDATE_SCRIPT, 3, ready, version, votes if target == "votes" else bookmarks,
+                                 TTL, command, *args)
+        except RedisError:
+            # a stale cache would lie to the client, drop it instead
+            logger.warning("Could not update interaction cache of user %s, dropping it", user_id)
+            try:
+                async with get_redis() as redis:
+                    await redis.delete(ready)
+            except RedisError:
+                pass
+
+
+interaction_cache = InteractionCache()
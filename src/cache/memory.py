@@ -0,0 +1,45 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache():
+    """Bounded in-process LRU whose entries expire after ttl seconds"""
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+
+    def get(self, key: Hashable, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+    def pop(self, key: Hashable, default=None):
+        item = self._data.pop(key, None)
+        return item[1] if item else default
+
+
+    def clear(self):
+        self._data.clear()
+
+
+    def __len__(self):
+        return len(self._data)
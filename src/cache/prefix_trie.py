@@ -0,0 +1,33 @@
+class PrefixTrie():
+    """
+    Case insensitive prefix trie, every node keeps its best completions
+    so a lookup costs O(len(prefix)) no matter how large the vocabulary is
+    """
+    def __init__(self, words: dict[str, int], top_k: int = 10):
+        # words maps the original spelling to its id
+        self.top_k = top_k
+        self._root: dict = {}
+
+        # shortest and then alphabetically first completions win
+        for word in sorted(words, key=lambda word: (len(word), word.lower())):
+            node = self._root
+            self._offer(node, word, words[word])
+            for char in word.lower():
+                node = node.setdefault(char, {})
+                self._offer(node, word, words[word])
+
+
+    def _offer(self, node: dict, word: str, id: int):
+        top = node.setdefault("", [])
+        if len(top) < self.top_k:
+            top.append((id, word))
+
+
+    def complete(self, prefix: str, limit: int = None) -> list[tuple[int, str]]:
+        """Return (id, word) pairs starting with prefix"""
+        node = self._root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get("", [])[:limit or self.top_k]
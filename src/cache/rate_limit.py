@@ -0,0 +1,73 @@
+import logging
+import math
+import time
+from src.cache.circuit_breaker import cache_breaker
+from src.cache.memory import TTLCache
+from src.cache.redis_config import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# KEYS: bucket; ARGV: capacity, refill per second, now, cost -> allowed, seconds until enough tokens
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(math.max(0, (cost - tokens) / rate))}
+"""
+
+
+class RateLimiter():
+    """
+    Token buckets shared by every worker through redis, one atomic script call per check.
+    When redis is unreachable each worker falls back to its own buckets, so limits stay
+    enforced per process instead of failing open or failing the request
+    """
+    def __init__(self, local_buckets: int = 10_000):
+        self._local = TTLCache(maxsize=local_buckets, ttl=60 * 60)
+
+
+    async def hit(self, key: str, capacity: int, per_seconds: float, cost: int = 1) -> tuple[bool, float]:
+        """
+        Take cost tokens from the bucket that refills capacity tokens every per_seconds
+        :return: whether the request is allowed and the seconds until it would be
+        """
+        rate = capacity / per_seconds
+        now = time.time()
+        # the breaker bounds each check by the cache timeout and skips redis at once while it is down
+        result = await cache_breaker.call(self._hit_redis, key, capacity, rate, now, cost)
+        if result is None:
+            logger.warning("Rate limiter falling back to in-process buckets")
+            return self._hit_local(key, capacity, rate, now, cost)
+        allowed, retry_after = result
+        return bool(allowed), float(retry_after)
+
+
+    async def _hit_redis(self, key: str, capacity: int, rate: float, now: float, cost: int) -> list:
+        async with get_redis() as redis:
+            return await redis.eval(TOKEN_BUCKET_SCRIPT, 1, f"ratelimit:{key}", capacity, rate, now, cost)
+
+
+    def _hit_local(self, key: str, capacity: int, rate: float, now: float, cost: int) -> tuple[bool, float]:
+        tokens, at = self._local.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0.0, now - at) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._local.set(key, (tokens, now), ttl=math.ceil(capacity / rate))
+        return allowed, max(0.0, (cost - tokens) / rate)
+
+
+rate_limiter = RateLimiter()
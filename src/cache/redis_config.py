@@ -7,16 +7,34 @@ from contextlib import asynccontextmanager
 
 load_dotenv()
 url = os.getenv("REDIS_URL")
+# "fakeredis" keeps cache, tokens and jobs in process, for benchmarks without a redis server
+BACKEND = os.getenv("REDIS_BACKEND", "redis")
 
-pool = ConnectionPool.from_url(
-    url=url,
-    db=0,
-    max_connections=10,
-    decode_responses=False,
-    socket_connect_timeout=5,
-    socket_keepalive=True
-)
-r = Redis(connection_pool=pool)
+if BACKEND == "fakeredis":
+    from fakeredis import FakeAsyncRedis
+    r = FakeAsyncRedis()
+    listener = r
+else:
+    pool = ConnectionPool.from_url(
+        url=url,
+        db=0,
+        max_connections=10,
+        decode_responses=False,
+        socket_connect_timeout=5,
+        socket_keepalive=True
+    )
+    r = Redis(connection_pool=pool)
+    # pub/sub subscriptions and the job worker's blocking reads hold a connection for as long as they wait,
+    # they get their own pool so requests never queue behind them. Two listeners and an inline worker per process
+    listener_pool = ConnectionPool.from_url(
+        url=url,
+        db=0,
+        max_connections=4,
+        decode_responses=False,
+        socket_connect_timeout=5,
+        socket_keepalive=True
+    )
+    listener = Redis(connection_pool=listener_pool)
 
 @asynccontextmanager
 async def get_redis() -> AsyncIterator[Redis]:
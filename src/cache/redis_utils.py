@@ -1,37 +1,164 @@
+import asyncio
+import logging
+import os
 import pickle
 import hashlib
+import time
+from typing import Awaitable, Callable, NamedTuple
+from sqlalchemy.ext.asyncio import AsyncSession
 from .redis_config import get_redis
+from .circuit_breaker import cache_breaker
+from src.database.core import get_db
 from fastapi import Request
+from starlette.datastructures import QueryParams
 
 
-def generate_cache_key(request: Request):
-    request_data = request.query_params
-    router = request.scope['router']
+logger = logging.getLogger(__name__)
 
-    hashed_data = pickle.dumps(sorted(request_data.items()))
+# strong references to in flight cache writes and refreshes, the loop only keeps weak ones
+_pending_writes: set[asyncio.Task] = set()
+# keys this worker is already refreshing
+_refreshing: set[str] = set()
+# upper bound of a refresh, a worker dying mid refresh blocks the key no longer than this
+REFRESH_LOCK_TTL = 30
+# keys per SCAN step and per UNLINK when a namespace is purged
+SCAN_BATCH = 500
+
+# writes an entry only when it was loaded after the namespace was last marked stale, so a refresh
+# racing a purge cannot put the purged data back
+STORE_SCRIPT = """
+local stale_at = tonumber(redis.call('GET', KEYS[2]) or '0')
+if tonumber(ARGV[1]) <= stale_at then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class CachePolicy(NamedTuple):
+    # fresh for soft_ttl seconds, served stale while refreshing until hard_ttl
+    soft_ttl: int
+    hard_ttl: int
+
+    @classmethod
+    def from_env(cls, name: str, soft_ttl: int, hard_ttl: int) -> "CachePolicy":
+        """Defaults overridable with CACHE_POLICY_<NAME>=<soft>/<hard>"""
+        override = os.getenv(f"CACHE_POLICY_{name.upper()}")
+        if override:
+            soft_ttl, hard_ttl = (int(part) for part in override.split("/"))
+        return cls(soft_ttl, hard_ttl)
+
+
+def cache_key(namespace: str, params: QueryParams):
+    # multi_items, repeated params like ?tag=a&tag=b are part of the query
+    hashed_data = pickle.dumps(sorted(params.multi_items()))
     digest = hashlib.sha256(hashed_data).hexdigest()
-    return f"cache:{router}:{digest}"
+    return f"cache:{namespace}:{digest}"
+
+
+def generate_cache_key(request: Request, namespace: str):
+    return cache_key(namespace, request.query_params)
+
+
+def _stale_key(namespace: str) -> str:
+    return f"cache-stale:{namespace}"
+
 
+def spawn(coro: Awaitable):
+    """Run a cache side effect after the response without awaiting it"""
+    task = asyncio.ensure_future(coro)
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
 
-async def delete_caches(pattern: str):
-    """Delete all caches containing a specified pattern"""
+
+async def delete_caches(pattern: str, batch: int = SCAN_BATCH):
+    """
+    Delete all caches containing a specified pattern. SCAN walks the keyspace in steps of about batch keys
+    instead of blocking redis for one KEYS over all of it, keys are deleted as each step comes back
+    """
     async with get_redis() as redis:
-        keys = await redis.keys(pattern)
+        keys = []
+        async for key in redis.scan_iter(match=pattern, count=batch):
+            keys.append(key)
+            if len(keys) >= batch:
+                await redis.unlink(*keys)
+                keys.clear()
         if keys:
-            await redis.delete(*keys)
+            await redis.unlink(*keys)
+
+
+async def purge_namespace(namespace: str):
+    """
+    Delete every entry of the namespace, for data that must not be served even stale. The stale marker
+    goes first, a refresh that loaded before the purge gets its write dropped by store_entry
+    """
+    await mark_stale(namespace)
+    await delete_caches(f"cache:{namespace}:*")
+
+
+async def mark_stale(namespace: str):
+    """
+    Invalidate every entry of the namespace without deleting it, readers keep getting the old
+    value while one of them refreshes it. A single SET, no key scan
+    """
+    async with get_redis() as redis:
+        await redis.set(_stale_key(namespace), time.time())
 
 
-async def set_cache(key: str, data):
+async def _get_entry(key: str, namespace: str) -> tuple[float, bytes, float] | None:
     async with get_redis() as redis:
-        hashed = pickle.dumps(data)
-        await redis.set(key, hashed)
+        entry, stale_at = await redis.mget(key, _stale_key(namespace))
+    if entry is None:
+        return None
+    created_at, data = pickle.loads(entry)
+    return created_at, data, float(stale_at or 0)
 
 
-async def get_cache(key: str):
+async def store_entry(key: str, namespace: str, data: bytes, created_at: float, policy: CachePolicy) -> bool:
+    """Write the entry unless the namespace was marked stale after created_at, returns whether it was written"""
     async with get_redis() as redis:
-        data = await redis.get(key)
+        return bool(await redis.eval(STORE_SCRIPT, 2, key, _stale_key(namespace),
+                                     created_at, pickle.dumps((created_at, data)), policy.hard_ttl))
+
+
+async def _refresh(key: str, namespace: str, loader: Callable[[AsyncSession], Awaitable[bytes]], policy: CachePolicy):
+    lock = f"{key}:refreshing"
+    try:
+        async with get_redis() as redis:
+            # one refresh per key across workers
+            if not await redis.set(lock, 1, nx=True, ex=REFRESH_LOCK_TTL):
+                return
         try:
-            data = pickle.loads(data)
-            return data
-        except TypeError:
-            return None
\ No newline at end of file
+            created_at = time.time()
+            async with get_db() as session:
+                data = await loader(session)
+            await cache_breaker.call(store_entry, key, namespace, data, created_at, policy)
+        finally:
+            async with get_redis() as redis:
+                await redis.delete(lock)
+    except Exception:
+        logger.exception("Could not refresh cache entry %s", key)
+    finally:
+        _refreshing.discard(key)
+
+
+async def cached(key: str, namespace: str, session: AsyncSession,
+                 loader: Callable[[AsyncSession], Awaitable[bytes]], policy: CachePolicy) -> bytes:
+    """
+    Stale-while-revalidate read. Fresh entries are returned as is, entries past their soft ttl or
+    marked stale are returned as well while a background task reloads them, misses load inline.
+    The background reload runs on its own session, the request one is closed by then
+    """
+    entry = await cache_breaker.call(_get_entry, key, namespace)
+    if entry is None:
+        created_at = time.time()
+        data = await loader(session)
+        spawn(cache_breaker.call(store_entry, key, namespace, data, created_at, policy))
+        return data
+
+    created_at, data, stale_at = entry
+    if (created_at <= stale_at or time.time() - created_at > policy.soft_ttl) and key not in _refreshing:
+        _refreshing.add(key)
+        spawn(_refresh(key, namespace, loader, policy))
+    return data
@@ -0,0 +1,75 @@
+import os
+from src.cache.redis_config import get_redis
+
+
+# a rotated token keeps answering with its successor this long, so parallel requests
+# carrying the same old cookie all get the new pair instead of a logout
+ROTATION_GRACE = int(os.getenv("REFRESH_ROTATION_GRACE") or 30)
+
+# KEYS: old token, new token, user family; ARGV: old jti, new jti, new token, username, ttl, grace
+ROTATE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current then return false end
+if string.sub(current, 1, 8) == 'rotated:' then return string.sub(current, 9) end
+if current ~= ARGV[4] then return false end
+redis.call('SET', KEYS[1], 'rotated:' .. ARGV[3], 'EX', ARGV[6])
+redis.call('SET', KEYS[2], ARGV[4], 'EX', ARGV[5])
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+return ARGV[3]
+"""
+
+
+class RefreshTokenStore():
+    """
+    Server side record of live refresh tokens by jti. A token is accepted only while its key exists,
+    each use rotates it into a new one and logging out or deleting the user revokes it
+    """
+    @staticmethod
+    def _key(jti: str) -> str:
+        return f"auth:refresh:{jti}"
+
+
+    @staticmethod
+    def _family_key(username: str) -> str:
+        return f"auth:refresh:user:{username}"
+
+
+    async def register(self, jti: str, username: str, ttl: int):
+        async with get_redis() as redis:
+            await (redis.pipeline(transaction=True)
+                .set(self._key(jti), username, ex=ttl)
+                .sadd(self._family_key(username), jti)
+                .expire(self._family_key(username), ttl)
+                .execute())
+
+
+    async def rotate(self, jti: str, username: str, new_jti: str, new_token: str, ttl: int) -> str | None:
+        """
+        Swap a live token for new_token in one atomic step
+        :return: the refresh token to hand out, the successor when the old one was just rotated
+        by a parallel request, None when it was revoked, expired or never issued
+        """
+        async with get_redis() as redis:
+            token = await redis.eval(ROTATE_SCRIPT, 3, self._key(jti), self._key(new_jti), self._family_key(username),
+                                     jti, new_jti, new_token, username, ttl, ROTATION_GRACE)
+        return token.decode() if token else None
+
+
+    async def revoke(self, jti: str, username: str):
+        async with get_redis() as redis:
+            await (redis.pipeline(transaction=True)
+                .delete(self._key(jti))
+                .srem(self._family_key(username), jti)
+                .execute())
+
+
+    async def revoke_all(self, username: str):
+        """Revoke every refresh token of the user, e.g. when they are deleted"""
+        async with get_redis() as redis:
+            jtis = await redis.smembers(self._family_key(username))
+            await redis.delete(self._family_key(username), *(self._key(jti.decode()) for jti in jtis))
+
+
+refresh_tokens = RefreshTokenStore()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.cache.prefix_trie import PrefixTrie
+from src.cache.redis_config import get_redis, listener
+from src.database.core import get_db
+from src.database.models.tags import Tags
+from src.schemas.posts import Tag, tag_list_adapter
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "tags:version"
+CHANNEL = "tags:changed"
+RESUBSCRIBE_DELAY = 5
+
+
+class TagCatalog():
+    """
+    Process wide copy of the tags table. Tag ids are serial, so id -> name is a dense
+    tuple indexed by id and name -> id a plain dict, lookups never touch the db
+    """
+    def __init__(self):
+        self.version = 0
+        self._ids_by_name: dict[str, int] = {}
+        self._names_by_id: tuple[str | None, ...] = ()
+        self.encoded: bytes = b"[]"
+        self.trie = PrefixTrie({})
+
+
+    def ids_for(self, names: list[str]) -> dict[str, int]:
+        """Map the known names to their ids, unknown names are dropped"""
+        return {name: self._ids_by_name[name] for name in names if name in self._ids_by_name}
+
+
+    def name_for(self, id: int) -> str | None:
+        return self._names_by_id[id] if 0 <= id < len(self._names_by_id) else None
+
+
+    def all(self) -> list[Tag]:
+        return [Tag(id=id, name=name) for id, name in enumerate(self._names_by_id) if name is not None]
+
+
+    def add(self, tags: dict[str, int]):
+        """Merge freshly created tags in without waiting for the reload"""
+        self._build({**self._ids_by_name, **tags})
+
+
+    def _build(self, ids_by_name: dict[str, int]):
+        names_by_id = [None] * (max(ids_by_name.values(), default=-1) + 1)
+        for name, id in ids_by_name.items():
+            names_by_id[id] = name
+
+        self._ids_by_name = ids_by_name
+        self._names_by_id = tuple(names_by_id)
+        self.encoded = tag_list_adapter.dump_json(self.all())
+        self.trie = PrefixTrie(ids_by_name)
+
+
+    async def load(self, session: AsyncSession):
+        """Replace the catalog with the current contents of the tags table"""
+        version = await self._current_version()
+        rows = (await session.execute(select(Tags.name, Tags.id))).all()
+        self._build({name: id for name, id in rows})
+        self.version = version
+
+
+    async def reload(self):
+        async with get_db() as session:
+            await self.load(session)
+
+
+    async def notify_changed(self):
+        """Bump the shared version so every worker reloads its catalog"""
+        try:
+            async with get_redis() as redis:
+                version = await redis.incr(VERSION_KEY)
+                await redis.publish(CHANNEL, version)
+        except RedisError:
+            logger.warning("Could not announce tag change, other workers will catch up on resubscribe")
+            await self.reload()
+
+
+    async def listen(self):
+        """Reload whenever the version gets bumped, run as a background task for the app lifetime"""
+        while True:
+            pubsub = listener.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                # bumps made while we were not subscribed
+                if await self._current_version() != self.version:
+                    await self.reload()
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message" and int(message["data"]) != self.version:
+                        await self.reload()
+            except (RedisError, OSError):
+                logger.warning("Tag catalog subscription lost, retrying in %s seconds", RESUBSCRIBE_DELAY)
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                await pubsub.aclose()
+
+
+    async def _current_version(self) -> int:
+        try:
+            async with get_redis() as redis:
+                return int(await redis.get(VERSION_KEY) or 0)
+        except RedisError:
+            return self.version
+
+
+tag_catalog = TagCatalog()
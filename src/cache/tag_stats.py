@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from typing import Iterable
+from redis.exceptions import RedisError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import select, func, extract
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.cache.redis_config import get_redis
+from src.cache.tag_catalog import tag_catalog
+from src.database.core import get_db
+from src.database.models.posts import Post
+from src.database.models.tags import tags_to_posts, tags_to_users
+from src.schemas.posts import TagStats
+
+
+logger = logging.getLogger(__name__)
+
+POSTS_KEY = "tags:stats:posts"
+FOLLOWERS_KEY = "tags:stats:followers"
+ACTIVITY_KEY = "tags:stats:activity"
+ACTIVITY_AT_KEY = "tags:stats:activity_at"
+RECOMPUTE_LOCK_KEY = "tags:stats:lock"
+
+# activity of a tag halves every ACTIVITY_HALF_LIFE seconds without new posts
+ACTIVITY_HALF_LIFE = int(os.getenv("TAG_ACTIVITY_HALF_LIFE") or 3 * 24 * 60 * 60)
+RECOMPUTE_INTERVAL = int(os.getenv("TAG_STATS_RECOMPUTE_INTERVAL") or 60 * 60)
+
+# decays the stored score to now before adding, so one hash field per tag is enough
+BUMP_ACTIVITY_SCRIPT = """
+local now = tonumber(ARGV[1])
+local half_life = tonumber(ARGV[2])
+local delta = tonumber(ARGV[3])
+for i = 4, #ARGV do
+    local score = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0')
+    local at = tonumber(redis.call('HGET', KEYS[2], ARGV[i]) or ARGV[1])
+    score = score * math.pow(2, -(now - at) / half_life) + delta
+    redis.call('HSET', KEYS[1], ARGV[i], tostring(score))
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[1])
+end
+return #ARGV - 3
+"""
+
+
+def decay(score: float, at: float, now: float) -> float:
+    return score * 2 ** (-(now - at) / ACTIVITY_HALF_LIFE)
+
+
+class TagStatsService():
+    """
+    Per tag post counts, follower counts and a decaying activity score kept in redis hashes.
+    Write paths apply deltas, reads are single HGETs, a periodic recompute corrects any drift
+    """
+    async def posts_changed(self, added: Iterable[int] = (), removed: Iterable[int] = (), touched: Iterable[int] = ()):
+        """Apply the tag delta of created, updated or deleted posts, touched tags gain activity"""
+        await self._apply(POSTS_KEY, self._deltas(added, removed), active=set(touched))
+
+
+    async def followers_changed(self, added: Iterable[int] = (), removed: Iterable[int] = ()):
+        """Apply the delta of a user's favorite tags"""
+        await self._apply(FOLLOWERS_KEY, self._deltas(added, removed))
+
+
+    async def get(self, tag_id: int) -> TagStats | None:
+        """Stats of a single tag, O(1) hash reads in one round trip"""
+        name = tag_catalog.name_for(tag_id)
+        if name is None:
+            return None
+
+        async with get_redis() as redis:
+            posts, followers, activity, activity_at = await (redis.pipeline(transaction=False)
+                .hget(POSTS_KEY, tag_id).hget(FOLLOWERS_KEY, tag_id)
+                .hget(ACTIVITY_KEY, tag_id).hget(ACTIVITY_AT_KEY, tag_id)
+                .execute())
+
+        now = time.time()
+        return TagStats(
+            id=tag_id,
+            name=name,
+            post_count=int(posts or 0),
+            follower_count=int(followers or 0),
+            activity=decay(float(activity or 0), float(activity_at or now), now)
+        )
+
+
+    async def all(self) -> list[TagStats]:
+        """Stats of every tag in the catalog, most active first"""
+        async with get_redis() as redis:
+            posts, followers, activity, activity_at = await (redis.pipeline(transaction=False)
+                .hgetall(POSTS_KEY).hgetall(FOLLOWERS_KEY)
+                .hgetall(ACTIVITY_KEY).hgetall(ACTIVITY_AT_KEY)
+                .execute())
+
+        now = time.time()
+        stats = []
+        for tag in tag_catalog.all():
+            key = str(tag.id).encode()
+            stats.append(TagStats(
+                id=tag.id,
+                name=tag.name,
+                post_count=int(posts.get(key, 0)),
+                follower_count=int(followers.get(key, 0)),
+                activity=decay(float(activity.get(key, 0)), float(activity_at.get(key, now)), now)
+            ))
+        return sorted(stats, key=lambda tag: (tag.activity, tag.post_count), reverse=True)
+
+
+    async def recompute(self, session: AsyncSession):
+        """Rebuild every counter from the association tables"""
+        posts = (await session.execute(
+            select(tags_to_posts.c.tag_id, func.count()).group_by(tags_to_posts.c.tag_id))).all()
+        followers = (await session.execute(
+            select(tags_to_users.c.tag_id, func.count()).group_by(tags_to_users.c.tag_id))).all()
+
+        # posts older than ten half lives contribute less than 0.1%
+        age = extract("epoch", func.now() - func.coalesce(Post.updated_at, Post.created_at))
+        activity = (await session.execute(
+            select(tags_to_posts.c.tag_id, func.sum(func.power(2, -age / ACTIVITY_HALF_LIFE)))
+            .join(Post, Post.id==tags_to_posts.c.post_id)
+            .where(age < ACTIVITY_HALF_LIFE * 10)
+            .group_by(tags_to_posts.c.tag_id))).all()
+
+        now = time.time()
+        async with get_redis() as redis:
+            pipe = redis.pipeline(transaction=True)
+            pipe.delete(POSTS_KEY, FOLLOWERS_KEY, ACTIVITY_KEY, ACTIVITY_AT_KEY)
+            if posts:
+                pipe.hset(POSTS_KEY, mapping=dict(posts))
+            if followers:
+                pipe.hset(FOLLOWERS_KEY, mapping=dict(followers))
+            if activity:
+                pipe.hset(ACTIVITY_KEY, mapping={tag_id: float(score) for tag_id, score in activity})
+                pipe.hset(ACTIVITY_AT_KEY, mapping={tag_id: now for tag_id, _ in activity})
+            await pipe.execute()
+
+
+    async def run_recompute(self, interval: int = RECOMPUTE_INTERVAL):
+        """Recompute on an interval for the app lifetime, only one worker wins each round"""
+        while True:
+            try:
+                async with get_redis() as redis:
+                    acquired = await redis.set(RECOMPUTE_LOCK_KEY, 1, nx=True, ex=max(interval - 1, 1))
+                if acquired:
+                    async with get_db() as session:
+                        await self.recompute(session)
+            except (RedisError, SQLAlchemyError, OSError):
+                logger.warning("Tag stats recompute failed, retrying next round")
+            await asyncio.sleep(interval)
+
+
+    @staticmethod
+    def _deltas(added: Iterable[int], removed: Iterable[int]) -> dict[int, int]:
+        """Net change per tag, a tag present in both cancels out"""
+        deltas = Counter(added)
+        deltas.subtract(removed)
+        return {tag_id: delta for tag_id, delta in deltas.items() if delta}
+
+
+    async def _apply(self, key: str, deltas: dict[int, int], active: set[int] = frozenset()):
+        if not deltas and not active:
+            return
+        try:
+            async with get_redis() as redis:
+                pipe = redis.pipeline(transaction=False)
+                for tag_id, delta in deltas.items():
+                    pipe.hincrby(key, tag_id, delta)
+                if active:
+                    pipe.eval(BUMP_ACTIVITY_SCRIPT, 2, ACTIVITY_KEY, ACTIVITY_AT_KEY,
+                              time.time(), ACTIVITY_HALF_LIFE, 1, *active)
+                await pipe.execute()
+        except RedisError:
+            # counters drift until the next recompute, never fail the write for it
+            logger.warning("Could not update tag stats for %s", key)
+
+
+tag_stats = TagStatsService()
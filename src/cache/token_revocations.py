@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+import time
+from redis.exceptions import RedisError
+from src.cache.bloom import BloomFilter
+from src.cache.redis_config import get_redis, listener
+
+
+logger = logging.getLogger(__name__)
+
+REVOKED_KEY = "auth:revoked"
+CHANNEL = "auth:revoked"
+RESUBSCRIBE_DELAY = 5
+# expected revocations alive at once, past it the false positive rate grows and costs redis lookups
+BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY") or 100_000)
+# rebuild interval that drops expired tokens from the filter
+REBUILD_INTERVAL = 10 * 60
+
+
+class TokenRevocations():
+    """
+    Revoked token ids live in a redis sorted set scored by token expiry. Every worker mirrors it
+    into a bloom filter, so checking a token that was never revoked costs no network call and
+    only filter hits are confirmed against redis
+    """
+    def __init__(self):
+        self.bloom = BloomFilter(BLOOM_CAPACITY)
+        self.loaded_at = 0.0
+
+
+    async def is_revoked(self, jti: str) -> bool:
+        if jti not in self.bloom:
+            return False
+        try:
+            async with get_redis() as redis:
+                return await redis.zscore(REVOKED_KEY, jti) is not None
+        except RedisError:
+            # a filter hit we cant confirm, refuse rather than accept a maybe revoked token
+            return True
+
+
+    async def revoke(self, jti: str, expires_at: float):
+        """Revoke a token until its own expiry and tell every worker"""
+        self.bloom.add(jti)
+        async with get_redis() as redis:
+            await (redis.pipeline(transaction=False)
+                .zadd(REVOKED_KEY, {jti: expires_at})
+                .publish(CHANNEL, jti)
+                .execute())
+
+
+    async def reload(self):
+        """Rebuild the filter from redis, expired revocations are pruned on the way"""
+        async with get_redis() as redis:
+            now = time.time()
+            await redis.zremrangebyscore(REVOKED_KEY, "-inf", now)
+            jtis = await redis.zrange(REVOKED_KEY, 0, -1)
+
+        bloom = BloomFilter(max(BLOOM_CAPACITY, len(jtis) * 2))
+        for jti in jtis:
+            bloom.add(jti)
+        self.bloom = bloom
+        self.loaded_at = now
+
+
+    async def listen(self):
+        """Mirror revocations from other workers, run as a background task for the app lifetime"""
+        while True:
+            pubsub = listener.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                # revocations made while we were not subscribed
+                await self.reload()
+
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=RESUBSCRIBE_DELAY)
+                    if message and message["type"] == "message":
+                        self.bloom.add(message["data"])
+                    if time.time() - self.loaded_at > REBUILD_INTERVAL:
+                        await self.reload()
+            except (RedisError, OSError):
+                logger.warning("Token revocation subscription lost, retrying in %s seconds", RESUBSCRIBE_DELAY)
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                await pubsub.aclose()
+
+
+revoked_tokens = TokenRevocations()
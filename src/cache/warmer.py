@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+from redis.exceptions import RedisError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import QueryParams
+from src.cache.circuit_breaker import cache_breaker
+from src.cache.redis_config import get_redis
+from src.cache.redis_utils import CachePolicy, cache_key, store_entry, spawn
+from src.database.core import get_db
+
+
+logger = logging.getLogger(__name__)
+
+HITS_KEY = "cache:hot"
+LOCK_KEY = "cache:warm:lock"
+# distinct endpoint + query combinations remembered, the least requested fall off
+MAX_TRACKED = 1000
+
+WARM_TOP_N = int(os.getenv("CACHE_WARM_TOP_N") or 50)
+WARM_CONCURRENCY = int(os.getenv("CACHE_WARM_CONCURRENCY") or 4)
+WARM_TIMEOUT = int(os.getenv("CACHE_WARM_TIMEOUT") or 30)
+WARM_ON_STARTUP = os.getenv("CACHE_WARM_ON_STARTUP", "1").lower() not in ("0", "false", "no")
+
+Loader = Callable[[AsyncSession], Awaitable[bytes]]
+
+
+class CacheWarmer():
+    """
+    Counts hits per endpoint and query string in a redis sorted set and recomputes the most
+    requested entries on demand, so a fresh deploy or an emptied redis doesnt send every
+    popular listing to postgres at once
+    """
+    def __init__(self):
+        self._endpoints: dict[str, tuple[str, str, CachePolicy, Callable[[QueryParams], Loader]]] = {}
+        self.warmed = False
+
+
+    def register(self, name: str, namespace: str, policy: CachePolicy, loader_for: Callable[[QueryParams], Loader],
+                 key_prefix: str = None):
+        """
+        namespace is the one passed to cached, key_prefix the one passed to generate_cache_key when it differs,
+        loader_for builds the loader of one cache entry from the query it was requested with
+        """
+        self._endpoints[name] = (namespace, key_prefix or namespace, policy, loader_for)
+
+
+    def record(self, name: str, params: QueryParams):
+        """Fire and forget hit count of a cached read"""
+        # sorted like cache_key, reordered params are one entry
+        query = str(QueryParams(sorted(params.multi_items())))
+        spawn(cache_breaker.call(self._record, f"{name}?{query}"))
+
+
+    async def _record(self, member: str):
+        async with get_redis() as redis:
+            await (redis.pipeline(transaction=False)
+                .zincrby(HITS_KEY, 1, member)
+                .zremrangebyrank(HITS_KEY, 0, -MAX_TRACKED - 1)
+                .execute())
+
+
+    async def warm(self, top: int = WARM_TOP_N, concurrency: int = WARM_CONCURRENCY) -> int:
+        """
+        Recompute the top entries with at most concurrency queries in flight,
+        only one worker warms at a time since they all share the cache
+        :return: amount of entries written, 0 when another worker holds the lock
+        """
+        async with get_redis() as redis:
+            if not await redis.set(LOCK_KEY, 1, nx=True, ex=WARM_TIMEOUT):
+                return 0
+            members = await redis.zrevrange(HITS_KEY, 0, top - 1)
+
+        try:
+            semaphore = asyncio.Semaphore(concurrency)
+            results = await asyncio.gather(*(self._warm_one(member.decode(), semaphore) for member in members))
+        finally:
+            async with get_redis() as redis:
+                await redis.delete(LOCK_KEY)
+        return sum(results)
+
+
+    async def _warm_one(self, member: str, semaphore: asyncio.Semaphore) -> bool:
+        name, _, query = member.partition("?")
+        if name not in self._endpoints:
+            return False
+        namespace, key_prefix, policy, loader_for = self._endpoints[name]
+        params = QueryParams(query)
+
+        async with semaphore:
+            try:
+                created_at = time.time()
+                async with get_db() as session:
+                    data = await loader_for(params)(session)
+                await store_entry(cache_key(key_prefix, params), namespace, data, created_at, policy)
+                return True
+            except ValueError:
+                # the query doesnt resolve anymore, e.g. a tag got removed
+                return False
+            except RedisError:
+                logger.warning("Could not store warmed cache entry %s", member)
+                return False
+            except (SQLAlchemyError, OSError):
+                # one failing query costs its entry, not the rest of the warm
+                logger.warning("Could not load warmed cache entry %s", member, exc_info=True)
+                return False
+
+
+    async def warm_on_startup(self):
+        """Warm within WARM_TIMEOUT, a slow or failing warm never blocks the worker from starting"""
+        try:
+            if WARM_ON_STARTUP:
+                count = await asyncio.wait_for(self.warm(), timeout=WARM_TIMEOUT)
+                logger.info("Warmed %s cache entries", count)
+        except (asyncio.TimeoutError, RedisError, OSError):
+            logger.warning("Cache warming did not finish, starting cold")
+        except Exception:
+            # runs inside the lifespan, anything escaping here would keep the worker from starting
+            logger.exception("Cache warming failed, starting cold")
+        finally:
+            self.warmed = True
+
+
+cache_warmer = CacheWarmer()
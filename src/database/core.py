@@ -1,8 +1,10 @@
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from starlette.requests import HTTPConnection, Request
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Table, MetaData, insert, select
+from sqlalchemy import Table, MetaData, insert, select, event, DDL
+from sqlalchemy.exc import IntegrityError
 import os
 from src.utils import hash_password
 
@@ -22,18 +24,48 @@ engine = create_async_engine(
 )
 
 sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+# autocommit connections send statements as they are, no BEGIN before the first read and no COMMIT after
+read_only_sessions = async_sessionmaker(bind=engine.execution_options(isolation_level="AUTOCOMMIT"),
+                                        expire_on_commit=False, class_=AsyncSession)
+
+READ_ONLY_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
 
 @asynccontextmanager
 async def get_db():
     async with sessions() as session:
         yield session
 
-async def get_session():
-    async with sessions() as session:
-        try:
-            yield session
-        finally:
-            await session.close()
+
+def violated_constraint(err: IntegrityError) -> str | None:
+    """Name of the constraint behind an IntegrityError, asyncpg keeps it on the error the dbapi adapter wraps"""
+    return getattr(err.orig.__cause__, "constraint_name", None)
+
+
+def request_session(conn: HTTPConnection) -> AsyncSession:
+    """
+    The unit of work of a request, created on first use and kept in request.state so middleware,
+    auth and endpoints share it. Sessions only check out a connection on their first statement,
+    safe methods get a read only one
+    """
+    session = getattr(conn.state, "db_session", None)
+    if session is None:
+        factory = read_only_sessions if conn.scope.get("method") in READ_ONLY_METHODS else sessions
+        session = conn.state.db_session = factory()
+    return session
+
+
+async def close_request_session(conn: HTTPConnection):
+    session = getattr(conn.state, "db_session", None)
+    if session is not None:
+        conn.state.db_session = None
+        await session.close()
+
+
+async def get_session(request: Request):
+    try:
+        yield request_session(request)
+    finally:
+        await close_request_session(request)
 
 
 
@@ -41,12 +73,18 @@ class Base(DeclarativeBase):
     pass
 
 
+# trigram indexes need the extension before create_all gets to them
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
 async def init_db():
+    """Development shortcut, deployed databases are managed by `alembic upgrade head` alone"""
     async with engine.begin() as con:
         await con.run_sync(Base.metadata.create_all)
 
 
-async def create_first_superuser():
+async def create_first_superuser() -> bool:
+    """Create the superuser from the SUPERUSER_* settings unless it exists, returns whether it was created"""
     from src.database.models.users import User, Roles
     async with get_db() as session:
         stmt = (await session.execute(select(User).where(User.username==SUPERUSER_NAME))).scalar_one_or_none()
@@ -60,3 +98,4 @@ async def create_first_superuser():
             )
             session.add(superuser)
             await session.commit()
+        return not stmt
@@ -1,35 +1,54 @@
 from fastapi import HTTPException, status
 from ..models import Comment
 from ..models.posts import Post, PostStatus, Vote
-from sqlalchemy import select, update, delete, Result, func
+from sqlalchemy import select, update, delete, insert, Result, func, literal, Integer
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from src.database.core import violated_constraint
 from ...schemas.comments import CreateCommentFinal, CommentRead, DeleteCommentFinal
 
 
+# foreign keys of comments and what a violation of them means to the caller
+MISSING_REFERENCES = {
+    "comments_parent_id_fkey": "Parent comment doesnt exist",
+    "comments_post_id_fkey": "Post doesnt exist",
+    "comments_author_id_fkey": "User doesnt exist",
+}
+
+
 class CommentService():
     def __init__(self, session: AsyncSession):
         self.session = session
 
 
     async def create_comment(self, comment_data: CreateCommentFinal) -> CommentRead:
-        """ Create new comment and return it """
-        post = await self.session.get(Post, comment_data.post_id)
-        if not post:
-            raise ValueError("Post doesnt exist")
-
-        dumped = comment_data.model_dump()
-        if dumped['parent_id']:
-            parent = await self.session.scalar(select(Comment.id).where(Comment.id==dumped['parent_id']))
-            if not parent:
-                raise ValueError("Comment doesnt exist")
-        dumped['parent_id'] = None
-
-        comment = Comment(**dumped)
-        self.session.add(comment)
-        await self.session.commit()
-        await self.session.refresh(comment)
+        """
+        Create new comment and return it in a single INSERT ... SELECT ... RETURNING,
+        the select yields no row when the post is missing or deleted or the parent comment is under another post
+        """
+        live_post = (select(literal(comment_data.content), literal(comment_data.author_id), Post.id,
+                            literal(comment_data.parent_id, Integer))
+                     .where(Post.id==comment_data.post_id, Post.deleted_at.is_(None)))
+        if comment_data.parent_id is not None:
+            live_post = live_post.where(
+                select(Comment.id).where(Comment.id==comment_data.parent_id, Comment.post_id==Post.id).exists())
+        stmt = (insert(Comment)
+                .from_select(["content", "author_id", "post_id", "parent_id"], live_post)
+                .returning(*Comment.__table__.c))
+        try:
+            row = (await self.session.execute(stmt)).one_or_none()
+            await self.session.commit()
+        except IntegrityError as err:
+            await self.session.rollback()
+            detail = MISSING_REFERENCES.get(violated_constraint(err))
+            if detail is None:
+                raise ValueError("Comment violates a constraint")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
 
-        return CommentRead.model_validate(comment)
+        if row is None:
+            detail = "Post doesnt exist" if comment_data.parent_id is None else "Post or parent comment doesnt exist"
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+        return CommentRead.model_validate(dict(row._mapping))
 
 
     async def delete_comment(self, delete_data: DeleteCommentFinal) -> bool:
@@ -0,0 +1,153 @@
+import os
+from redis.exceptions import RedisError
+from sqlalchemy import select, delete, func, any_, literal_column, Table, Column
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.cache.interactions import interaction_cache
+from src.cache.redis_config import get_redis
+from src.cache.tag_stats import tag_stats
+from src.database.models import Post, User, Comment, bookmark_table, tags_to_posts, tags_to_users
+from src.database.models.posts import Vote
+from src.schemas.users import DeletionProgress
+
+
+BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE") or 1000)
+PROGRESS_TTL = 24 * 60 * 60
+
+
+class DeletionService():
+    """
+    Removes soft deleted posts and users together with their dependent rows,
+    BATCH_SIZE rows per transaction so no single statement locks a whole user's history
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+
+    @staticmethod
+    def progress_key(kind: str, id: int) -> str:
+        return f"deletion:{kind}:{id}"
+
+
+    async def progress(self, kind: str, id: int) -> DeletionProgress | None:
+        async with get_redis() as redis:
+            data = await redis.hgetall(self.progress_key(kind, id))
+        if not data:
+            return None
+        return DeletionProgress(
+            status=data[b"status"].decode(),
+            stage=data.get(b"stage", b"").decode() or None,
+            removed_rows=int(data.get(b"removed_rows", 0))
+        )
+
+
+    async def owner(self, kind: str, id: int) -> int | None:
+        """Id of the user whose data is being deleted, recorded for posts deleted on their own"""
+        async with get_redis() as redis:
+            owner_id = await redis.hget(self.progress_key(kind, id), "owner_id")
+        return int(owner_id) if owner_id else None
+
+
+    async def purge_post(self, post_id: int, progress: str = None, author_id: int = None):
+        """
+        Delete a post's comments, votes, bookmarks and tag links in batches, then the post
+        :param progress: key to report to when the post is part of a user's deletion
+        :param author_id: recorded with the progress, only the author and admins may read it
+        """
+        owned = progress is None
+        progress = progress or self.progress_key("post", post_id)
+        if owned:
+            await self._report(progress, status="running", owner_id=author_id)
+
+        await self._purge_rows(Comment.__table__, Comment.post_id, post_id, progress)
+        voters = await self._purge_rows(Vote.__table__, Vote.post_id, post_id, progress, returning=Vote.author_id)
+        bookmarkers = await self._purge_rows(bookmark_table, bookmark_table.c.post_id, post_id, progress,
+                                             returning=bookmark_table.c.user_id)
+        tag_ids = await self._purge_rows(tags_to_posts, tags_to_posts.c.post_id, post_id, progress,
+                                         returning=tags_to_posts.c.tag_id)
+
+        await self.session.execute(delete(Post).where(Post.id==post_id))
+        await self.session.commit()
+
+        await tag_stats.posts_changed(removed=tag_ids)
+        await interaction_cache.post_removed(post_id, set(voters) | set(bookmarkers))
+        await self._report(progress, status="done" if owned else None, removed=1)
+
+
+    async def purge_user(self, user_id: int):
+        """Purge every post of the user one by one, then their remaining rows, then the user"""
+        progress = self.progress_key("user", user_id)
+        await self._report(progress, status="running")
+
+        while True:
+            post_ids = (await self.session.scalars(
+                select(Post.id).where(Post.author_id==user_id).limit(BATCH_SIZE))).all()
+            if not post_ids:
+                break
+            for post_id in post_ids:
+                await self.purge_post(post_id, progress=progress)
+
+        await self._purge_rows(Comment.__table__, Comment.author_id, user_id, progress)
+        await self._purge_rows(Vote.__table__, Vote.author_id, user_id, progress)
+        await self._purge_rows(bookmark_table, bookmark_table.c.user_id, user_id, progress)
+        tag_ids = await self._purge_rows(tags_to_users, tags_to_users.c.user_id, user_id, progress,
+                                         returning=tags_to_users.c.tag_id)
+
+        await self.session.execute(delete(User).where(User.id==user_id))
+        await self.session.commit()
+
+        await tag_stats.followers_changed(removed=tag_ids)
+        # every interaction cache entry of the user points at rows that are gone now
+        try:
+            async with get_redis() as redis:
+                await redis.delete(*(f"interactions:{user_id}:{part}" for part in ("ready", "votes", "bookmarks")))
+        except RedisError:
+            pass
+        await self._report(progress, status="done", removed=1)
+
+
+    async def _purge_rows(self, table: Table, column: Column, value: int, progress: str,
+                          returning: Column = None) -> list:
+        """
+        Delete rows where column == value in batches, each in its own transaction.
+        Rows are picked by ctid so tables with composite keys batch the same way
+        :return: values of the returning column across every batch
+        """
+        ctid = literal_column("ctid")
+        returned = []
+        while True:
+            batch = select(ctid).select_from(table).where(column==value).limit(BATCH_SIZE).scalar_subquery()
+            stmt = delete(table).where(ctid == any_(func.array(batch)))
+            if returning is not None:
+                stmt = stmt.returning(returning)
+
+            result = await self.session.execute(stmt)
+            if returning is not None:
+                rows = result.scalars().all()
+                returned += rows
+                removed = len(rows)
+            else:
+                removed = result.rowcount
+            await self.session.commit()
+
+            await self._report(progress, stage=table.name, removed=removed)
+            if removed < BATCH_SIZE:
+                return returned
+
+
+    async def _report(self, progress: str, status: str = None, stage: str = None, removed: int = 0,
+                      owner_id: int = None):
+        try:
+            async with get_redis() as redis:
+                pipe = redis.pipeline(transaction=False)
+                if status:
+                    pipe.hset(progress, "status", status)
+                if owner_id is not None:
+                    pipe.hset(progress, "owner_id", owner_id)
+                pipe.hset(progress, "stage", stage or "")
+                if removed:
+                    pipe.hincrby(progress, "removed_rows", removed)
+                pipe.expire(progress, PROGRESS_TTL)
+                await pipe.execute()
+        except RedisError:
+            # progress is informational, the deletion itself goes on
+            pass
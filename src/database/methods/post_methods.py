@@ -1,40 +1,66 @@
-from typing import Literal
+from typing import Literal, AsyncIterator
 
+import orjson
 from fastapi import HTTPException, status
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
-from ..models import Comment, Tags
+from ..models import Comment, Tags, tags_to_posts
+from src.cache.tag_catalog import tag_catalog
+from src.jobs import queue
+from src.cache.interactions import interaction_cache
 from ..models.posts import Post, PostStatus, Vote
-from ..models.users import User
+from ..models.users import User, bookmark_table
 from src.schemas.posts import PostCreateFinal, PostRead, PostUpdateFinal, PostStatus, PostDeleteFinal, RatePostFinal, \
-    DeletePostRatingFinal, Tag
-from sqlalchemy import select, update, delete, Result, func
+    DeletePostRatingFinal, Tag, post_list_adapter, PostImport, PostInteraction
+from sqlalchemy import select, update, delete, insert, Result, func, String, Integer, any_, bindparam, case, \
+    literal, literal_column, JSON
 from sqlalchemy.ext.asyncio import AsyncSession
+from src.database.core import violated_constraint
 
 
 
+# foreign keys the post writes can violate, a missing author or post is a 404 and a missing tag a bad request
+MISSING_REFERENCES = {
+    "posts_author_id_fkey": (status.HTTP_404_NOT_FOUND, "User doesnt exist"),
+    "bookmarks_user_id_fkey": (status.HTTP_404_NOT_FOUND, "User doesnt exist"),
+    "bookmarks_post_id_fkey": (status.HTTP_404_NOT_FOUND, "Post doesnt exist"),
+    "tags_to_posts_tag_id_fkey": (status.HTTP_400_BAD_REQUEST, "Tag doesnt exist"),
+}
+
+
+def missing_reference(err: IntegrityError) -> HTTPException:
+    status_code, detail = MISSING_REFERENCES.get(violated_constraint(err),
+                                                 (status.HTTP_400_BAD_REQUEST, "Post violates a constraint"))
+    return HTTPException(status_code=status_code, detail=detail)
+
+
 class PostService():
     def __init__(self, session: AsyncSession):
         self.session = session
 
 
     async def create_post(self, post_data: PostCreateFinal) -> PostRead:
-        """Create a post and return it"""
-        user_exists = await self.session.scalar(select(User).where(User.id==post_data.author_id))
-        if not user_exists:
-            raise ValueError(f"User {post_data.author_id} doesnt exist")
-
+        """
+        Create a post and return it, one INSERT ... RETURNING for the post and one multi-row insert
+        for its tags. A missing author or tag surfaces as a foreign key violation, told apart by its name
+        """
         values = post_data.model_dump(exclude={"tags"})
-        new_post = Post(**values)
+        tags = [Tag(id=tag.id, name=tag.name) for tag in post_data.tags]
 
-        if post_data.tags:
-            new_post.tags = post_data.tags
-            await self.session.flush()
-
-        self.session.add(new_post)
-        await self.session.commit()
-        await self.session.refresh(new_post)
+        try:
+            row = (await self.session.execute(insert(Post).values(**values).returning(*Post.__table__.c))).one()
+            if tags:
+                await self.session.execute(insert(tags_to_posts), [{"post_id": row.id, "tag_id": tag.id} for tag in tags])
+            await self.session.commit()
+        except IntegrityError as err:
+            await self.session.rollback()
+            raise missing_reference(err)
 
-        return PostRead.model_validate(new_post)
+        tag_ids = [tag.id for tag in tags]
+        await queue.enqueue("tag_stats.posts_changed", idempotency_key=f"post-created:{row.id}",
+                            added=tag_ids, touched=tag_ids)
+        return PostRead.model_validate({**row._mapping, "tags": tags, "comments": []})
 
 
     async def get_posts(self, id: int = None,
@@ -49,13 +75,16 @@ class PostService():
         :param search_query: str to match with title
         :return: list of validated posts
         """
-        stmt = select(Post).options(joinedload(Post.comments))
+        stmt = select(Post).options(joinedload(Post.comments)).where(Post.deleted_at.is_(None))
 
         if id:
             stmt = stmt.where(Post.id==id)
 
         if tags:
-            stmt = stmt.where(Post.tags.any(Tags.name.in_(tags)))
+            tag_ids = list(tag_catalog.ids_for(tags).values())
+            if not tag_ids:
+                return []
+            stmt = stmt.where(Post.id.in_(select(tags_to_posts.c.post_id).where(tags_to_posts.c.tag_id.in_(tag_ids))))
 
         if search_query:
             stmt = (stmt.where(Post.status==PostStatus.PUBLIC)
@@ -71,51 +100,92 @@ class PostService():
         posts = await self.session.scalars(stmt)
         if not posts:
             raise ValueError("No posts found")
-        return [PostRead.model_validate(post) for post in posts.unique().all()]
+        return post_list_adapter.validate_python(posts.unique().all(), from_attributes=True)
+
+
+    async def get_many(self, ids: list[int]) -> list[PostRead | None]:
+        """
+        Get posts by a list of ids in a single query
+        :return: posts aligned with the input ids, None where a post doesnt exist
+        """
+        stmt = (select(Post).options(joinedload(Post.comments))
+                .where(Post.id == any_(bindparam("ids", ids, type_=ARRAY(Integer))), Post.deleted_at.is_(None)))
+        posts = {post.id: post for post in (await self.session.scalars(stmt)).unique().all()}
+
+        return [PostRead.model_validate(posts[id]) if id in posts else None for id in ids]
+
+
+    async def get_tags_many(self, ids: list[int]) -> list[Tag | None]:
+        """Get tags by a list of ids from the in-memory catalog, aligned with the input ids"""
+        names = [tag_catalog.name_for(id) for id in ids]
+        return [Tag(id=id, name=name) if name is not None else None for id, name in zip(ids, names)]
 
 
     async def update_post(self, update_data: PostUpdateFinal) -> PostRead:
-        """Update the post if user matches the author"""
+        """
+        Update the post if user matches the author. Ownership is part of the UPDATE's WHERE and the
+        current tags and comments come back through RETURNING, so the happy path is a single statement
+        plus at most one delete and one insert when the tags change
+        """
         data = update_data.model_dump(exclude={'id', 'author_id', 'tags'}, exclude_unset=True)
         if not data:
             raise ValueError("No fields to update")
 
-        post = await self.session.get(Post, update_data.id)
-        if not post:
-            raise ValueError("Post doesnt exist")
-        if post.author_id != update_data.author_id:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not your post!")
-
         data['updated_at'] = func.now()
-        new_status = data.get('status', PostStatus.DRAFT)
-        if new_status != PostStatus.DRAFT and post.status != PostStatus.DRAFT:
-            data['status'] = new_status
-            data['published_at'] = func.now()
-
-        stmt = update(Post).where(Post.id==update_data.id).values(**data).returning(Post)
-        updated_post = await self.session.execute(stmt)
+        if data.get('status', PostStatus.DRAFT) != PostStatus.DRAFT:
+            data['published_at'] = case((Post.status != PostStatus.DRAFT, func.now()), else_=Post.published_at)
+
+        # subqueries in RETURNING see the tables as they were before this statement
+        tag_ids = select(func.array_agg(tags_to_posts.c.tag_id)).where(tags_to_posts.c.post_id==Post.id).scalar_subquery()
+        comments = (select(func.json_agg(literal_column("comments"), type_=JSON))
+                    .select_from(Comment).where(Comment.post_id==Post.id).scalar_subquery())
+        stmt = (update(Post)
+                .where(Post.id==update_data.id, Post.author_id==update_data.author_id, Post.deleted_at.is_(None))
+                .values(**data)
+                .returning(*Post.__table__.c, tag_ids.label("tag_ids"), comments.label("comment_rows")))
+        row = (await self.session.execute(stmt)).one_or_none()
+        if row is None:
+            await self.session.rollback()
+            owner = await self.session.scalar(select(Post.author_id).where(Post.id==update_data.id, Post.deleted_at.is_(None)))
+            if owner is None:
+                raise ValueError("Post doesnt exist")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not your post!")
 
+        old_tag_ids = new_tag_ids = set(row.tag_ids or ())
+        names = {tag.id: tag.name for tag in update_data.tags or ()}
         if update_data.tags:
-            post.tags = update_data.tags
-            await self.session.flush()
-
+            new_tag_ids = {tag.id for tag in update_data.tags}
+            if old_tag_ids - new_tag_ids:
+                await self.session.execute(delete(tags_to_posts).where(
+                    tags_to_posts.c.post_id==row.id, tags_to_posts.c.tag_id.in_(old_tag_ids - new_tag_ids)))
+            if new_tag_ids - old_tag_ids:
+                await self.session.execute(insert(tags_to_posts),
+                                           [{"post_id": row.id, "tag_id": tag_id} for tag_id in new_tag_ids - old_tag_ids])
         await self.session.commit()
-        await self.session.refresh(post)
-        return PostRead.model_validate(updated_post.scalar())
+
+        await queue.enqueue("tag_stats.posts_changed",
+                            added=list(new_tag_ids), removed=list(old_tag_ids), touched=list(new_tag_ids))
+        values = {column: row._mapping[column] for column in Post.__table__.c.keys()}
+        tags = [Tag(id=tag_id, name=names.get(tag_id) or tag_catalog.name_for(tag_id)) for tag_id in sorted(new_tag_ids)]
+        return PostRead.model_validate({**values, "tags": tags, "comments": row.comment_rows or []})
 
 
     async def delete_post(self, post_data: PostDeleteFinal) -> bool:
-        """Delete the post if user matches the author"""
+        """
+        Hide the post if user matches the author and schedule the actual deletion,
+        its dependent rows are removed in batches by a background job
+        """
         post = await self.session.get(Post, post_data.id)
-        if not post:
+        if not post or post.deleted_at:
             raise ValueError("Post doesnt exist")
         if post.author_id != post_data.author_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not your post!")
 
-        stmt = delete(Post).where(Post.id==post.id)
-        await self.session.execute(stmt)
+        await self.session.execute(update(Post).where(Post.id==post.id).values(deleted_at=func.now()))
         await self.session.commit()
 
+        await queue.enqueue("deletion.post", idempotency_key=f"delete-post:{post.id}", post_id=post.id,
+                            author_id=post.author_id)
         return True
 
 
@@ -126,7 +196,7 @@ class PostService():
         """
         post = await self.session.get(Post, rating_data.post_id)
 
-        if not post:
+        if not post or post.deleted_at:
             raise ValueError("Post doesnt exist")
         vote = await self.session.scalars(select(Vote)
                     .where(Vote.author_id==rating_data.author_id, Vote.post_id==rating_data.post_id))
@@ -143,6 +213,7 @@ class PostService():
         result = await self.session.scalar(stmt)
 
         await self.session.commit()
+        await interaction_cache.vote_changed(rating_data.author_id, rating_data.post_id, rating_data.value)
         return {"id": post.id,
                 "new_rating": result}
 
@@ -154,7 +225,7 @@ class PostService():
         """
         post = await self.session.get(Post, change_data.post_id)
 
-        if not post:
+        if not post or post.deleted_at:
             raise ValueError("Post doesnt exist")
 
         vote = (await self.session.execute(delete(Vote)
@@ -171,35 +242,152 @@ class PostService():
 
         result = await self.session.scalar(stmt)
         await self.session.commit()
+        await interaction_cache.vote_changed(change_data.author_id, change_data.post_id, None)
         return {"new_rating": result}
 
 
     async def bookmark_post(self, user_id: int, post_id: int) -> dict[str: str]:
         """
-        Add a post to user's bookmarks
+        Toggle a post in user's bookmarks with at most two statements on the bookmarks table,
+        no matter how many bookmarks the user already has. Only live posts can be bookmarked
         :return: dict with operation's status
         """
-        post = await self.session.get(Post, post_id)
-        if not post:
-            raise ValueError("Post doesnt exist")
-        user = (await self.session.scalars(select(User).where(User.id==user_id).options(joinedload(User.bookmarks)))).first()
-        if not user:
-            raise ValueError("User doesnt exist")
-
-
-        bookmarked_already = next((bookmark for bookmark in user.bookmarks if bookmark.id == post_id), None)
-        if bookmarked_already:
-            user.bookmarks.remove(bookmarked_already)
+        removed = await self.session.scalar(
+            delete(bookmark_table)
+            .where(bookmark_table.c.user_id==user_id, bookmark_table.c.post_id==post_id)
+            .returning(bookmark_table.c.post_id))
+        if removed is not None:
             await self.session.commit()
+            await interaction_cache.bookmark_changed(user_id, post_id, False)
             return {"status": "removed"}
 
-        user.bookmarks.append(post)
-        await self.session.commit()
+        live_post = select(literal(user_id), Post.id).where(Post.id==post_id, Post.deleted_at.is_(None))
+        try:
+            added = await self.session.scalar(
+                pg_insert(bookmark_table)
+                .from_select(["user_id", "post_id"], live_post)
+                .on_conflict_do_nothing()
+                .returning(bookmark_table.c.post_id))
+            await self.session.commit()
+        except IntegrityError as err:
+            await self.session.rollback()
+            raise missing_reference(err)
+        if added is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post doesnt exist")
+        await interaction_cache.bookmark_changed(user_id, post_id, True)
         return {"status": "added"}
 
 
+    async def interactions(self, user_id: int, post_ids: list[int]) -> list[PostInteraction]:
+        """
+        User's vote and bookmark state for a page of posts, one indexed ANY() query per table
+        :return: interaction state aligned with the input post ids
+        """
+        ids = bindparam("ids", post_ids, type_=ARRAY(Integer))
+        votes = dict((await self.session.execute(
+            select(Vote.post_id, Vote.value).where(Vote.author_id==user_id, Vote.post_id == any_(ids)))).all())
+        bookmarked = set((await self.session.scalars(
+            select(bookmark_table.c.post_id)
+            .where(bookmark_table.c.user_id==user_id, bookmark_table.c.post_id == any_(ids)))).all())
+
+        return [PostInteraction(post_id=post_id, vote=votes.get(post_id), bookmarked=post_id in bookmarked)
+                for post_id in post_ids]
+
+
+    async def user_interactions(self, user_id: int) -> tuple[dict[int, int], set[int]]:
+        """Every vote (post_id -> value) and bookmarked post id of the user"""
+        votes = dict((await self.session.execute(
+            select(Vote.post_id, Vote.value).where(Vote.author_id==user_id))).all())
+        bookmarked = set((await self.session.scalars(
+            select(bookmark_table.c.post_id).where(bookmark_table.c.user_id==user_id))).all())
+        return votes, bookmarked
+
+
     async def _get_all_tags(self) -> list[Tag]:
-        """Utility for viewing all existing tags"""
-        tags = (await self.session.scalars(select(Tags))).all()
+        """Utility for viewing all existing tags, served from the in-memory catalog"""
+        return tag_catalog.all()
+
+
+    async def export_posts(self, batch_size: int = 1000) -> AsyncIterator[bytes]:
+        """
+        Stream every post as ndjson through a server side cursor, memory stays flat regardless of table size
+        :param batch_size: rows fetched from the cursor per round trip
+        :return: ndjson encoded batches of posts
+        """
+        tag_names = (select(Tags.name)
+                     .join(tags_to_posts, tags_to_posts.c.tag_id==Tags.id)
+                     .where(tags_to_posts.c.post_id==Post.id)
+                     .scalar_subquery())
+        stmt = (select(Post.id, Post.author_id, Post.title, Post.content, Post.status, Post.rating,
+                       Post.view_count, Post.created_at, Post.published_at, Post.updated_at,
+                       func.array(tag_names, type_=ARRAY(String)).label("tags"))
+                .where(Post.deleted_at.is_(None))
+                .order_by(Post.id)
+                .execution_options(yield_per=batch_size))
+
+        result = await self.session.stream(stmt)
+        async for rows in result.mappings().partitions():
+            yield b"".join(orjson.dumps(dict(row), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+    async def import_posts(self, posts: list[PostImport]) -> int:
+        """
+        Bulk insert a chunk of posts in one multi-row insert, missing tags are created on the way
+        :return: amount of inserted posts
+        """
+        tag_ids, created_tags = await self._get_or_create_tag_ids({name for post in posts for name in post.tags})
+
+        now = None
+        if any(post.created_at is None for post in posts):
+            now = await self.session.scalar(select(func.now()))
+
+        values = []
+        for post in posts:
+            row = post.model_dump(exclude={"tags"})
+            row['created_at'] = row['created_at'] or now
+            row['updated_at'] = row['updated_at'] or row['created_at']
+            values.append(row)
+
+        try:
+            post_ids = (await self.session.scalars(
+                insert(Post).returning(Post.id, sort_by_parameter_order=True), values)).all()
+
+            links = [{"post_id": post_id, "tag_id": tag_ids[name]}
+                     for post_id, post in zip(post_ids, posts) for name in set(post.tags)]
+            if links:
+                await self.session.execute(insert(tags_to_posts), links)
+            await self.session.commit()
+        except IntegrityError as err:
+            await self.session.rollback()
+            # reported with the line the chunk ended on, the detail says which reference broke
+            raise ValueError(f"Chunk failed: {missing_reference(err).detail}")
+
+        if created_tags:
+            tag_catalog.add(created_tags)
+            await tag_catalog.notify_changed()
+        await queue.enqueue("tag_stats.posts_changed", added=[link["tag_id"] for link in links])
+        return len(post_ids)
 
-        return [Tag.model_validate(tag) for tag in tags]
\ No newline at end of file
+
+    async def _get_or_create_tag_ids(self, names: set[str]) -> tuple[dict[str, int], dict[str, int]]:
+        """
+        Resolve tag names to ids, creating unknown ones with a single INSERT ... ON CONFLICT DO NOTHING RETURNING.
+        The caller owns the commit and should announce the created tags to the catalog afterwards
+        :return: ids of all names and ids of the tags created by this call
+        """
+        tag_ids = tag_catalog.ids_for(names)
+        missing = names - tag_ids.keys()
+        if not missing:
+            return tag_ids, {}
+
+        stmt = (pg_insert(Tags).values([{"name": name} for name in missing])
+                .on_conflict_do_nothing(index_elements=[Tags.name])
+                .returning(Tags.name, Tags.id))
+        created = dict((await self.session.execute(stmt)).all())
+        tag_ids.update(created)
+
+        # created by another worker after our catalog was loaded
+        if missing - tag_ids.keys():
+            tag_ids.update((await self.session.execute(
+                select(Tags.name, Tags.id).where(Tags.name.in_(missing - tag_ids.keys())))).all())
+        return tag_ids, created
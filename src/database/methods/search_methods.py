@@ -0,0 +1,50 @@
+from sqlalchemy import select, func, literal, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.cache.tag_catalog import tag_catalog
+from src.database.models import Tags, User, Post
+from src.database.models.posts import PostStatus
+from src.schemas.search import Suggestion, Suggestions
+
+
+class SearchService():
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+
+    async def suggest(self, query: str, limit: int = 5) -> Suggestions:
+        """
+        Prefix and fuzzy matches for tags, usernames and public post titles in one round trip.
+        Every branch is served by a pg_trgm GIN index, prefix matches rank above fuzzy ones
+        :param query: text typed so far
+        :param limit: max suggestions per category
+        """
+        def branch(kind: str, id_column, text_column, *criteria):
+            is_prefix = text_column.istartswith(query, autoescape=True)
+            score = func.similarity(text_column, query)
+            return (select(literal(kind).label("kind"), id_column.label("id"),
+                           text_column.label("text"), score.label("score"))
+                    .where(is_prefix | text_column.op("%")(query), *criteria)
+                    .order_by(is_prefix.desc(), score.desc())
+                    .limit(limit))
+
+        stmt = union_all(
+            branch("tags", Tags.id, Tags.name),
+            branch("users", User.id, User.username, User.deleted_at.is_(None)),
+            branch("posts", Post.id, Post.title, Post.status==PostStatus.PUBLIC, Post.deleted_at.is_(None)),
+        )
+        rows = (await self.session.execute(stmt)).all()
+
+        result = Suggestions()
+        for kind, id, text, score in rows:
+            getattr(result, kind).append(Suggestion(id=id, text=text, score=score))
+
+        # the in-memory trie knows every tag prefix, fuzzy db matches only fill the remaining slots
+        prefixed = self.tag_prefixes(query, limit)
+        seen = {tag.id for tag in prefixed}
+        result.tags = (prefixed + [tag for tag in result.tags if tag.id not in seen])[:limit]
+        return result
+
+    @staticmethod
+    def tag_prefixes(query: str, limit: int = 5) -> list[Suggestion]:
+        """Tags starting with query, answered by the in-memory trie without touching the db"""
+        return [Suggestion(id=id, text=name, score=1) for id, name in tag_catalog.trie.complete(query, limit)]
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import os
+from redis.exceptions import RedisError
+from sqlalchemy import select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.cache.redis_config import get_redis
+from src.database.core import get_db
+from src.database.models import User, author_stats
+from src.schemas.users import AuthorStats, author_stats_list_adapter
+
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = int(os.getenv("AUTHOR_STATS_REFRESH_INTERVAL") or 5 * 60)
+REFRESH_LOCK_KEY = "author_stats:lock"
+
+
+class AuthorStatsService():
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+
+    async def get(self, user_id: int) -> AuthorStats | None:
+        """Precomputed stats of a single author, an index lookup on the materialized view"""
+        stmt = (select(author_stats, User.username)
+                .join(User, User.id==author_stats.c.user_id)
+                .where(author_stats.c.user_id==user_id, User.deleted_at.is_(None)))
+        row = (await self.session.execute(stmt)).mappings().first()
+
+        return AuthorStats.model_validate(row) if row else None
+
+
+    async def leaderboard(self, limit: int = 20, offset: int = 0) -> list[AuthorStats]:
+        """Authors ordered by karma, walks the karma index"""
+        stmt = (select(author_stats, User.username)
+                .join(User, User.id==author_stats.c.user_id)
+                .where(User.deleted_at.is_(None))
+                .order_by(author_stats.c.karma.desc(), author_stats.c.user_id)
+                .limit(limit).offset(offset))
+        rows = (await self.session.execute(stmt)).mappings().all()
+
+        return author_stats_list_adapter.validate_python(rows)
+
+
+    async def refresh(self):
+        """Rebuild the view without blocking readers"""
+        await self.session.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY author_stats"))
+        await self.session.commit()
+
+
+async def run_refresh(interval: int = REFRESH_INTERVAL):
+    """Refresh the view on an interval for the app lifetime, only one worker wins each round"""
+    while True:
+        try:
+            async with get_redis() as redis:
+                acquired = await redis.set(REFRESH_LOCK_KEY, 1, nx=True, ex=max(interval - 1, 1))
+            if acquired:
+                async with get_db() as session:
+                    await AuthorStatsService(session).refresh()
+        except (RedisError, SQLAlchemyError, OSError):
+            logger.warning("Author stats refresh failed, retrying next round")
+        await asyncio.sleep(interval)
@@ -1,14 +1,23 @@
+import logging
 from fastapi import HTTPException
+from redis.exceptions import RedisError
 from sqlalchemy.orm import joinedload
 
 from src.database.models import Post
-from src.schemas.posts import PostRead
+from src.schemas.posts import PostRead, PostPage, post_list_adapter
 from src.schemas.users import UserRead, UserCreate, UserUpdateFinal, Profile
-from src.database.models import User
-from sqlalchemy import select, update, delete
+from src.database.models import User, bookmark_table
+from src.jobs import queue
+from src.cache.refresh_tokens import refresh_tokens
+from sqlalchemy import select, update, delete, insert, any_, bindparam, Integer, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
+logger = logging.getLogger(__name__)
+
+
 
 class UserService():
     def __init__(self, session: AsyncSession):
@@ -16,18 +25,16 @@ class UserService():
 
 
     async def create(self, user_data: UserCreate) -> UserRead:
-        """Create a user and return them"""
-        user_exists = await self.session.scalar(select(User).where(User.username==user_data.username))
-        if user_exists:
-            raise ValueError("User with same username already exists")
-
-        values = user_data.model_dump()
-        new_user = User(**values)
+        """Create a user and return them, taken usernames and emails surface as unique violations"""
+        query = insert(User).values(**user_data.model_dump()).returning(*User.__table__.c)
+        try:
+            new_user = (await self.session.execute(query)).one()
+            await self.session.commit()
+        except IntegrityError:
+            await self.session.rollback()
+            raise ValueError("User with same username or email already exists")
 
-        self.session.add(new_user)
-        await self.session.commit()
-
-        return UserRead.model_validate(new_user)
+        return UserRead.model_validate(dict(new_user._mapping))
 
 
     async def get(self, by_id: int = None, by_username: str = None, return_raw: bool = False) -> UserRead | User:
@@ -41,7 +48,7 @@ class UserService():
         if not by_id and not by_username:
             raise ValueError("No criteria specified")
 
-        query = select(User)
+        query = select(User).where(User.deleted_at.is_(None))
         if by_id:
             query = query.where(User.id==by_id)
         elif by_username:
@@ -58,61 +65,117 @@ class UserService():
         return UserRead.model_validate(user)
 
 
+    async def get_many(self, ids: list[int]) -> list[UserRead | None]:
+        """
+        Get users by a list of ids in a single query
+        :return: users aligned with the input ids, None where a user doesnt exist
+        """
+        query = select(User).where(User.id == any_(bindparam("ids", ids, type_=ARRAY(Integer))), User.deleted_at.is_(None))
+        users = {user.id: user for user in (await self.session.scalars(query)).all()}
+
+        return [UserRead.model_validate(users[id]) if id in users else None for id in ids]
+
+
     async def update(self, update_data: UserUpdateFinal) -> UserRead:
-        """Update user and return them"""
-        user_exists = await self.session.scalar(select(User.id).where(User.id==update_data.id))
-        if not user_exists:
-            raise HTTPException(status_code=404, detail="User doesnt exist")
-        values = update_data.model_dump(exclude_unset=True)
-        if values is None:
+        """Update user and return them in a single UPDATE ... RETURNING"""
+        values = update_data.model_dump(exclude={"id"}, exclude_unset=True)
+        if not values:
             raise ValueError("No fields to update")
 
-        query = update(User).where(User.id==update_data.id).values(**values).returning(User)
-        updated_user = await self.session.execute(query)
-        updated_user = updated_user.scalar()
+        query = (update(User).where(User.id==update_data.id, User.deleted_at.is_(None))
+                 .values(**values).returning(*User.__table__.c))
+        updated_user = (await self.session.execute(query)).one_or_none()
         await self.session.commit()
 
-        return UserRead.model_validate(updated_user)
+        if updated_user is None:
+            raise HTTPException(status_code=404, detail="User doesnt exist")
+        return UserRead.model_validate(dict(updated_user._mapping))
 
 
-    async def delete(self, id: int, password: str) -> bool:
-        """Delete the user (handle proper admin access checking in endpoints)"""
-        user = await self.session.scalar(select(User).where(User.id==id))
+    async def delete(self, id: int, password: str) -> str:
+        """
+        Hide the user together with their posts in one transaction, so every listing that skips deleted posts
+        skips theirs too, and schedule the actual deletion of them and everything they wrote
+        (handle proper admin access checking in endpoints)
+        :return: username of the hidden user
+        """
+        user = await self.session.scalar(select(User).where(User.id==id, User.deleted_at.is_(None)))
         if not user:
             raise ValueError("Invalid data")
         if password != user.password:
             raise ValueError("Invalid data")
-        query = delete(User).where(User.id==id)
-        result = await self.session.execute(query)
+        query = update(User).where(User.id==id).values(deleted_at=func.now())
+        await self.session.execute(query)
+        await self.session.execute(update(Post).where(Post.author_id==id, Post.deleted_at.is_(None))
+                                   .values(deleted_at=func.now()))
 
         await self.session.commit()
 
-        return result.rowcount > 0
+        try:
+            await refresh_tokens.revoke_all(user.username)
+        except RedisError:
+            # deleted users fail the lookup on refresh anyway
+            logger.warning("Could not revoke refresh tokens of user %s", id)
+        # their posts may sit in cached listings, which serve stale entries while refreshing
+        await queue.enqueue("cache.purge", namespace="posts")
+        await queue.enqueue("deletion.user", idempotency_key=f"delete-user:{id}", user_id=id)
+        return user.username
 
 
     async def add_tag_to_favorites(self, user_id: int, tags: list) -> bool:
         """Add a tag to user's favorites"""
-        stmt = select(User).where(User.id==user_id).options(joinedload(User.favorite_tags))
+        # the request's user may be a cached copy in this session, its favorites are reloaded before diffing
+        stmt = (select(User).where(User.id==user_id).options(joinedload(User.favorite_tags))
+                .execution_options(populate_existing=True))
         user = (await self.session.scalars(stmt)).first()
 
         if not user:
             raise HTTPException(status_code=404, detail="User doesnt exist")
 
+        old_tag_ids = [tag.id for tag in user.favorite_tags]
         user.favorite_tags = tags
         await self.session.commit()
 
+        await queue.enqueue("tag_stats.followers_changed", added=[tag.id for tag in tags], removed=old_tag_ids)
+
         return True
 
     async def user_posts(self, user_id: int) -> list[PostRead]:
         """Return a list of posts belonging to user"""
-        stmt = await self.session.scalars(select(Post).where(Post.author_id==user_id).options(joinedload(Post.comments)))
+        stmt = await self.session.scalars(select(Post).where(Post.author_id==user_id, Post.deleted_at.is_(None)).options(joinedload(Post.comments)))
         posts = stmt.unique().all()
-        return [PostRead.model_validate(post) for post in posts]
+        return post_list_adapter.validate_python(posts, from_attributes=True)
 
 
-    async def profile(self, user_id: int) -> Profile:
-        """Return a complete list of user's data"""
-        stmt = await self.session.scalars(select(User).where(User.id==user_id).options(joinedload(User.bookmarks), joinedload(User.favorite_tags)))
-        result = stmt.first()
+    async def bookmarked_posts(self, user_id: int, cursor: int = None, limit: int = 20) -> PostPage:
+        """
+        Page through user's bookmarks, newest post first
+        :param cursor: next_cursor of the previous page
+        :param limit: posts per page
+        """
+        stmt = (select(Post)
+                .join(bookmark_table, bookmark_table.c.post_id==Post.id)
+                .where(bookmark_table.c.user_id==user_id, Post.deleted_at.is_(None))
+                .order_by(bookmark_table.c.post_id.desc())
+                .limit(limit + 1))
+        if cursor:
+            stmt = stmt.where(bookmark_table.c.post_id < cursor)
+
+        posts = (await self.session.scalars(stmt)).unique().all()
+        next_cursor = posts[limit - 1].id if len(posts) > limit else None
+
+        return PostPage(items=post_list_adapter.validate_python(posts[:limit], from_attributes=True),
+                        next_cursor=next_cursor)
 
-        return Profile.model_validate(result)
\ No newline at end of file
+
+    async def profile(self, user_id: int) -> Profile:
+        """Return user's data with a bookmark count, bookmarks themselves are paged separately"""
+        bookmark_count = (select(func.count()).select_from(bookmark_table)
+                          .where(bookmark_table.c.user_id==User.id)
+                          .scalar_subquery())
+        stmt = select(User, bookmark_count).where(User.id==user_id).options(joinedload(User.favorite_tags))
+        user, count = (await self.session.execute(stmt)).unique().one()
+
+        profile = Profile.model_validate(user)
+        profile.bookmark_count = count
+        return profile
\ No newline at end of file
@@ -2,5 +2,6 @@ from .users import User, bookmark_table
 from .posts import Post
 from .comments import Comment
 from .tags import Tags, tags_to_posts, tags_to_users
+from .author_stats import author_stats
 
-__all__ = ["User", "Post", "Comment", "bookmark_table", "Tags", "tags_to_users", "tags_to_posts"]
\ No newline at end of file
+__all__ = ["User", "Post", "Comment", "bookmark_table", "Tags", "tags_to_users", "tags_to_posts", "author_stats"]
\ No newline at end of file
@@ -0,0 +1,48 @@
+from sqlalchemy import Table, MetaData, Column, Integer, BigInteger, DDL, event
+from ..core import Base
+
+
+# Materialized view, kept out of Base.metadata so create_all and autogenerate never treat it as a table
+view_metadata = MetaData()
+
+author_stats = Table(
+    "author_stats",
+    view_metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("post_count", BigInteger),
+    Column("total_rating", BigInteger),
+    Column("total_views", BigInteger),
+    Column("comment_count", BigInteger),
+    Column("karma", BigInteger),
+)
+
+# karma: votes received on own posts plus comments other people left on them, soft deleted posts no longer count
+AUTHOR_STATS_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS author_stats AS
+SELECT users.id AS user_id,
+       coalesce(p.post_count, 0) AS post_count,
+       coalesce(p.total_rating, 0) AS total_rating,
+       coalesce(p.total_views, 0) AS total_views,
+       coalesce(c.comment_count, 0) AS comment_count,
+       coalesce(p.total_rating, 0) + coalesce(c.comment_count, 0) AS karma
+FROM users
+LEFT JOIN (
+    SELECT author_id, count(*) AS post_count, sum(rating) AS total_rating, sum(view_count) AS total_views
+    FROM posts WHERE deleted_at IS NULL GROUP BY author_id
+) p ON p.author_id = users.id
+LEFT JOIN (
+    SELECT posts.author_id, count(*) AS comment_count
+    FROM comments JOIN posts ON posts.id = comments.post_id
+    WHERE comments.author_id != posts.author_id AND posts.deleted_at IS NULL
+    GROUP BY posts.author_id
+) c ON c.author_id = users.id
+"""
+
+# the unique index is what allows REFRESH ... CONCURRENTLY
+AUTHOR_STATS_INDEXES_SQL = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_author_stats_user_id ON author_stats (user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_author_stats_karma ON author_stats (karma DESC, user_id)",
+]
+
+for statement in [AUTHOR_STATS_SQL, *AUTHOR_STATS_INDEXES_SQL]:
+    event.listen(Base.metadata, "after_create", DDL(statement))
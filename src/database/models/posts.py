@@ -43,6 +43,8 @@ class Post(Base):
     title: Mapped[str] = mapped_column(String(50), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     published_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # set when a deletion is scheduled, the row itself is removed by a background job
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[created_at]
     updated_at: Mapped[updated_at]
 
@@ -64,6 +66,10 @@ class Post(Base):
     view_count: Mapped[int] = mapped_column(Integer, default=0)
     status: Mapped[PostStatus] = mapped_column(SQLEnum(PostStatus), default=PostStatus.DRAFT)
 
+    __table_args__ = (
+        Index("ix_posts_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+    )
+
     def __repr__(self):
         return f"Id: {self.id} | Author: {self.author_id} | Title: {self.title}"
 
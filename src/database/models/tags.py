@@ -12,16 +12,16 @@ from sqlalchemy.dialects.postgresql import JSONB
 tags_to_users = Table(
     "tags_to_users",
     Base.metadata,
-    Column("user_id", ForeignKey("users.id"), primary_key=True),
-    Column("tag_id", ForeignKey("tags.id"), primary_key=True)
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
 )
 
 
 tags_to_posts = Table(
     "tags_to_posts",
     Base.metadata,
-    Column("post_id", ForeignKey("posts.id"), primary_key=True),
-    Column("tag_id", ForeignKey("tags.id"), primary_key=True)
+    Column("post_id", ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
 )
 
 
@@ -34,5 +34,9 @@ class Tags(Base):
     favorited_by: Mapped[list["User"]] = relationship(back_populates="favorite_tags", secondary=tags_to_users)
     post_tags: Mapped[list["Post"]] = relationship(back_populates="tags", secondary=tags_to_posts)
 
+    __table_args__ = (
+        Index("ix_tags_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
+
     def __repr__(self):
         return f"Id: {self.id} | Name: {self.name}"
\ No newline at end of file
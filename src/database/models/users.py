@@ -35,8 +35,8 @@ class OccupationGrades(StrEnum):
 bookmark_table = Table(
     "bookmarks",
     Base.metadata,
-    Column("user_id", ForeignKey("users.id"), primary_key=True),
-    Column("post_id", ForeignKey("posts.id"), primary_key=True)
+    Column("user_id", ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("post_id", ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
 )
 
 
@@ -56,6 +56,8 @@ class User(Base):
     occupation: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
     occupation_grade: Mapped[Optional[OccupationGrades]] = mapped_column(SQLEnum(OccupationGrades), nullable=True)
     last_login: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # set when a deletion is scheduled, the row itself is removed by a background job
+    deleted_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     # relationships
     bookmarks: Mapped[list["Post"]] = relationship(
@@ -74,6 +76,10 @@ class User(Base):
     is_verified: Mapped[bool] = mapped_column(Boolean, default=False)
     role: Mapped[Roles] = mapped_column(SQLEnum(Roles), default=Roles.USER)
 
+    __table_args__ = (
+        Index("ix_users_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+    )
+
     def __repr__(self):
         return f"Id: {self.id} | Username: {self.username} | Email: {self.email}"
 
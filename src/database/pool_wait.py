@@ -0,0 +1,47 @@
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, ORMExecuteState
+
+
+# observations older than this dont describe the pool anymore
+WINDOW = 5
+
+
+class PoolWaitMonitor():
+    """
+    Moving average of how long sessions wait between their first statement and holding a connection,
+    which is pool checkout time plus connect time for fresh connections
+    """
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._average = 0.0
+        self._observed_at = 0.0
+
+
+    def observe(self, seconds: float):
+        self._average += self.alpha * (seconds - self._average)
+        self._observed_at = time.monotonic()
+
+
+    @property
+    def average(self) -> float:
+        if time.monotonic() - self._observed_at > WINDOW:
+            return 0.0
+        return self._average
+
+
+pool_wait = PoolWaitMonitor()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_first_statement(state: ORMExecuteState):
+    # fires before the session checks out a connection, only the first statement of a transaction waits
+    if not state.session.in_transaction():
+        state.session.info["waiting_since"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_begin")
+def _record_wait(session: Session, transaction, connection):
+    started = session.info.pop("waiting_since", None)
+    if started is not None:
+        pool_wait.observe(time.perf_counter() - started)
@@ -0,0 +1,22 @@
+import os
+from src.jobs.queue import JobQueue, job, handlers
+
+
+# "fakeredis" keeps the whole queue in process for local runs and tests
+BACKEND = os.getenv("JOBS_BACKEND", "redis")
+# run a worker inside every app process instead of a separate `python -m src.jobs`
+INLINE_WORKER = os.getenv("JOBS_INLINE_WORKER", "1").lower() not in ("0", "false", "no")
+
+
+def _make_queue() -> JobQueue:
+    if BACKEND == "fakeredis":
+        from fakeredis import FakeAsyncRedis
+        return JobQueue(FakeAsyncRedis(), poll_interval=0.05)
+
+    from src.cache.redis_config import r, listener
+    return JobQueue(r, blocking_redis=listener)
+
+
+queue = _make_queue()
+
+__all__ = ["queue", "job", "handlers", "JobQueue", "INLINE_WORKER"]
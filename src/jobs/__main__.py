@@ -0,0 +1,18 @@
+"""Standalone job worker: `python -m src.jobs`"""
+import asyncio
+import logging
+import signal
+from src.jobs import queue
+import src.jobs.tasks  # registers the handlers
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, queue.stop)
+    await queue.run_worker()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import Awaitable, Callable
+from uuid import uuid4
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+
+logger = logging.getLogger(__name__)
+
+STREAM = "jobs:stream"
+GROUP = "workers"
+DELAYED = "jobs:delayed"
+DEAD = "jobs:dead"
+
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS") or 5)
+BACKOFF_BASE = float(os.getenv("JOBS_BACKOFF_BASE") or 1)
+BACKOFF_MAX = 300
+BATCH_SIZE = 16
+BLOCK_MS = 1000
+# pending messages idle this long belong to a dead consumer and get claimed by a live one
+CLAIM_IDLE_MS = 60 * 1000
+STREAM_MAXLEN = 100_000
+KEY_TTL = 24 * 60 * 60
+# jobs kept in process while redis is unreachable, the oldest are dropped past it
+MAX_UNSENT = int(os.getenv("JOBS_MAX_UNSENT") or 10_000)
+FLUSH_INTERVAL = 5
+
+# moves due retries back onto the stream atomically, so two workers never both promote one
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'job', job)
+end
+return #due
+"""
+
+handlers: dict[str, Callable[..., Awaitable]] = {}
+# jobs that are dropped instead of kept for later when they cant be queued
+best_effort_jobs: set[str] = set()
+
+
+def job(name: str, best_effort: bool = False):
+    """
+    Register a coroutine as the handler of a job name
+    :param best_effort: losing the job costs little, e.g. cache upkeep that expires on its own
+    """
+    def register(handler: Callable[..., Awaitable]):
+        handlers[name] = handler
+        if best_effort:
+            best_effort_jobs.add(name)
+        return handler
+    return register
+
+
+def backoff(attempt: int) -> float:
+    return min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+
+
+class JobQueue():
+    """
+    At-least-once job queue on a redis stream with a consumer group.
+    Failed jobs are retried with exponential backoff through a delayed sorted set
+    and land in a dead letter stream once they run out of attempts
+    """
+    def __init__(self, redis: Redis, poll_interval: float = 0, blocking_redis: Redis = None):
+        self.redis = redis
+        # XREADGROUP BLOCK holds its connection for the whole wait, keep it off the pool requests enqueue through
+        self.blocking_redis = blocking_redis or redis
+        # backends that ignore BLOCK need a pause between empty reads to not spin the loop
+        self.poll_interval = poll_interval
+        self._stopping = asyncio.Event()
+        # payloads that could not be queued, resent by run_flusher once redis is back
+        self._unsent: deque[bytes] = deque(maxlen=MAX_UNSENT)
+
+
+    async def enqueue(self, name: str, *, idempotency_key: str = None, **kwargs) -> str | None:
+        """
+        Queue a job and return its id right away
+        :param idempotency_key: jobs sharing a key within a day are queued only once
+        :return: job id, None if the key was already used
+        """
+        if idempotency_key:
+            try:
+                if not await self.redis.set(f"jobs:key:{idempotency_key}", 1, nx=True, ex=KEY_TTL):
+                    return None
+            except RedisError:
+                pass
+
+        job_id = uuid4().hex
+        payload = orjson.dumps({"id": job_id, "name": name, "kwargs": kwargs, "attempt": 0})
+        try:
+            await self.redis.xadd(STREAM, {"job": payload}, maxlen=STREAM_MAXLEN, approximate=True)
+        except RedisError:
+            # never run inline, the request already committed and some jobs run for minutes
+            if name in best_effort_jobs:
+                logger.warning("Could not queue %s, dropping it", name)
+            else:
+                logger.warning("Could not queue %s, keeping it until redis is back", name)
+                self._unsent.append(payload)
+        return job_id
+
+
+    async def flush_unsent(self) -> int:
+        """Queue the jobs kept while redis was unreachable, returns how many made it"""
+        sent = 0
+        while self._unsent:
+            payload = self._unsent.popleft()
+            try:
+                await self.redis.xadd(STREAM, {"job": payload}, maxlen=STREAM_MAXLEN, approximate=True)
+            except RedisError:
+                self._unsent.appendleft(payload)
+                break
+            sent += 1
+        return sent
+
+
+    async def run_flusher(self, interval: float = FLUSH_INTERVAL):
+        """Resend kept jobs every interval seconds, run as a background task for the app lifetime"""
+        while True:
+            await asyncio.sleep(interval)
+            if self._unsent and await self.flush_unsent():
+                logger.info("Queued jobs kept while redis was unreachable, %s left", len(self._unsent))
+
+
+    async def run_worker(self, consumer: str = None):
+        """Consume jobs until stop() is called"""
+        consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._consumer = consumer
+        self._stopping.clear()
+        await self._ensure_group()
+
+        while not self._stopping.is_set():
+            try:
+                await self.redis.eval(PROMOTE_SCRIPT, 2, DELAYED, STREAM, time.time(), STREAM_MAXLEN)
+
+                _, claimed, *_ = await self.redis.xautoclaim(STREAM, GROUP, consumer, CLAIM_IDLE_MS,
+                                                             start_id="0-0", count=BATCH_SIZE)
+                for message_id, fields in claimed:
+                    await self._consume(message_id, fields)
+
+                response = await self.blocking_redis.xreadgroup(GROUP, consumer, {STREAM: ">"},
+                                                                count=BATCH_SIZE, block=BLOCK_MS)
+                for _, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._consume(message_id, fields)
+                if not response:
+                    await asyncio.sleep(self.poll_interval)
+            except RedisError:
+                logger.warning("Job worker lost redis, retrying")
+                await asyncio.sleep(1)
+            except Exception:
+                logger.exception("Job worker iteration failed, retrying")
+                await asyncio.sleep(1)
+
+
+    def stop(self):
+        self._stopping.set()
+
+
+    async def _ensure_group(self):
+        try:
+            await self.redis.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        except ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+
+
+    async def _consume(self, message_id: bytes, fields: dict):
+        """
+        Process one entry, an entry that cant be processed at all (malformed, foreign, failing to fail)
+        is moved to the dead letter stream instead of taking the worker down. Redis errors stay
+        with the caller, the entry remains pending and is claimed again once redis is back
+        """
+        try:
+            await self._process(message_id, fields)
+        except RedisError:
+            raise
+        except Exception as err:
+            logger.error("Job entry %s could not be processed: %r", message_id, err)
+            await (self.redis.pipeline(transaction=True)
+                   .xadd(DEAD, {**fields, "error": repr(err)}, maxlen=STREAM_MAXLEN, approximate=True)
+                   .xack(STREAM, GROUP, message_id)
+                   .execute())
+
+
+    async def _process(self, message_id: bytes, fields: dict):
+        job = orjson.loads(fields[b"job"])
+        done_key = f"jobs:done:{job['id']}"
+
+        # redelivered after a crash between finishing and acking
+        if await self.redis.exists(done_key):
+            await self.redis.xack(STREAM, GROUP, message_id)
+            return
+
+        try:
+            handler = handlers.get(job["name"])
+            if handler is None:
+                raise LookupError(f"No handler registered for {job['name']}")
+            heartbeat = asyncio.create_task(self._heartbeat(message_id))
+            try:
+                await handler(**job["kwargs"])
+            finally:
+                heartbeat.cancel()
+        except Exception as err:
+            await self._fail(message_id, job, err)
+            return
+
+        await (self.redis.pipeline(transaction=True)
+               .set(done_key, 1, ex=KEY_TTL)
+               .xack(STREAM, GROUP, message_id)
+               .execute())
+
+
+    async def _heartbeat(self, message_id: bytes):
+        """
+        Reclaim the entry for this consumer while its handler runs, resetting its idle time,
+        so a purge running longer than CLAIM_IDLE_MS isnt claimed and run again by another worker
+        """
+        while True:
+            await asyncio.sleep(CLAIM_IDLE_MS / 1000 / 3)
+            try:
+                await self.redis.xclaim(STREAM, GROUP, self._consumer, 0, [message_id], justid=True)
+            except RedisError:
+                logger.warning("Could not extend claim of job entry %s", message_id)
+
+
+    async def _fail(self, message_id: bytes, job: dict, err: Exception):
+        job["attempt"] += 1
+        pipe = self.redis.pipeline(transaction=True)
+        if job["attempt"] >= MAX_ATTEMPTS:
+            logger.error("Job %s (%s) failed for good: %r", job["name"], job["id"], err)
+            pipe.xadd(DEAD, {"job": orjson.dumps(job), "error": repr(err)}, maxlen=STREAM_MAXLEN, approximate=True)
+        else:
+            logger.warning("Job %s (%s) failed, attempt %s: %r", job["name"], job["id"], job["attempt"], err)
+            pipe.zadd(DELAYED, {orjson.dumps(job): time.time() + backoff(job["attempt"])})
+        pipe.xack(STREAM, GROUP, message_id)
+        await pipe.execute()
@@ -0,0 +1,42 @@
+from src.cache.redis_utils import delete_caches, mark_stale, purge_namespace
+from src.cache.tag_stats import tag_stats
+from src.database.core import get_db
+from src.database.methods.deletion_methods import DeletionService
+from src.jobs.queue import job
+
+
+@job("cache.delete", best_effort=True)
+async def delete_caches_job(pattern: str):
+    await delete_caches(pattern)
+
+
+@job("cache.purge", best_effort=True)
+async def purge_namespace_job(namespace: str):
+    await purge_namespace(namespace)
+
+
+@job("cache.mark_stale", best_effort=True)
+async def mark_stale_job(namespace: str):
+    await mark_stale(namespace)
+
+
+@job("tag_stats.posts_changed")
+async def tag_stats_posts_changed(added: list[int] = (), removed: list[int] = (), touched: list[int] = ()):
+    await tag_stats.posts_changed(added=added, removed=removed, touched=touched)
+
+
+@job("tag_stats.followers_changed")
+async def tag_stats_followers_changed(added: list[int] = (), removed: list[int] = ()):
+    await tag_stats.followers_changed(added=added, removed=removed)
+
+
+@job("deletion.post")
+async def purge_post(post_id: int, author_id: int = None):
+    async with get_db() as session:
+        await DeletionService(session).purge_post(post_id, author_id=author_id)
+
+
+@job("deletion.user")
+async def purge_user(user_id: int):
+    async with get_db() as session:
+        await DeletionService(session).purge_user(user_id)
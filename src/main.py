@@ -1,35 +1,77 @@
+import asyncio
+import os
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.gzip import GZipMiddleware
 import uvicorn
-from database.core import init_db, create_first_superuser
-from src.api.v1 import users, posts, comments
+from src.api.v1 import users, posts, comments, search, metrics, health
 from src.admin.setup import init_admin
-from src.database.core import engine
-from src.middlewares import admin_protection_middleware
+from src.database.core import engine, init_db, create_first_superuser
+from src.middlewares import AdminProtectionMiddleware, AuthCookieMiddleware, LoadSheddingMiddleware
 from contextlib import asynccontextmanager
-from src.cache.redis_config import r
+from src.cache.redis_config import r, listener
+from src.cache.tag_catalog import tag_catalog
+from src.cache.tag_stats import tag_stats
+from src.cache.token_revocations import revoked_tokens
+from src.cache.warmer import cache_warmer
+from src.database.methods.stats_methods import run_refresh as refresh_author_stats
+from src.jobs import queue, INLINE_WORKER
+import src.jobs.tasks  # registers the job handlers
 
 
+# responses smaller than this are not worth the cpu time of compressing
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE") or 1024)
+# create_all and the superuser check on every start, for local runs. Deploys run `alembic upgrade head`
+# and `python -m src.superuser` once instead of every worker racing through them
+BOOTSTRAP_ON_STARTUP = os.getenv("BOOTSTRAP_ON_STARTUP", "1").lower() not in ("0", "false", "no")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    await create_first_superuser()
-    init_admin(app, engine)
+    if BOOTSTRAP_ON_STARTUP:
+        await init_db()
+        await create_first_superuser()
+    await tag_catalog.reload()
+    await cache_warmer.warm_on_startup()
+    tag_listener = asyncio.create_task(tag_catalog.listen())
+    revocation_listener = asyncio.create_task(revoked_tokens.listen())
+    tag_stats_recompute = asyncio.create_task(tag_stats.run_recompute())
+    author_stats_refresh = asyncio.create_task(refresh_author_stats())
+    job_worker = asyncio.create_task(queue.run_worker()) if INLINE_WORKER else None
+    job_flusher = asyncio.create_task(queue.run_flusher())
     yield
+    job_flusher.cancel()
+    await queue.flush_unsent()
+    if job_worker:
+        queue.stop()
+        await job_worker
+    tag_listener.cancel()
+    revocation_listener.cancel()
+    tag_stats_recompute.cancel()
+    author_stats_refresh.cancel()
     await r.close()
+    await listener.aclose()
 
 app = FastAPI(
     title="FastAPI blog app",
     description="Unoriginal, but im trying my best",
     version="0.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-app.middleware("http")(admin_protection_middleware)
+app.add_middleware(AuthCookieMiddleware)
+app.add_middleware(AdminProtectionMiddleware)
+app.add_middleware(LoadSheddingMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
 
 
 app.include_router(users.router)
 app.include_router(posts.router)
 app.include_router(comments.router)
+app.include_router(search.router)
+app.include_router(metrics.router)
+app.include_router(health.router)
+init_admin(app, engine)
 
 
 if __name__ == '__main__':
@@ -1,35 +1,148 @@
-from fastapi import Request, HTTPException
-from fastapi.responses import JSONResponse
-from src.database.core import get_session, get_db
-from src.api.dependencies import get_current_user, mod_access
-
-
-async def admin_protection_middleware(request: Request, call_next):
-    """ Middleware for locking endpoints only to users with moderator+ access """
-    if not request.url.path.startswith("/admin"):
-        return await call_next(request)
-
-    token = request.cookies.get("access_token")
-    if not token:
-        return JSONResponse(
-            {"detail": "Missing authorization token"},
-            status_code=401
-        )
-
-    try:
-        async with get_db() as session:
-            user = await get_current_user(request, session=session)
-            is_mod_or_above = await mod_access(user=user)
-
-            if not is_mod_or_above:
-                raise HTTPException(
-                    status_code=403,
-                    detail="Admin access required"
-                )
-        return await call_next(request)
-
-    except HTTPException as e:
-        return JSONResponse(
-            {"detail": str(e.detail)},
-            status_code=e.status_code
-        )
\ No newline at end of file
+import os
+import time
+from sqlalchemy import select
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.api.dependencies import access_token_subject
+from src.api.v1.health import PROBE_PATHS
+from src.cache.memory import TTLCache
+from src.database.core import request_session, close_request_session
+from src.database.pool_wait import pool_wait
+from src.database.models.users import User, Roles
+
+
+# how long a role decision is trusted before the users table is asked again
+ADMIN_ROLE_TTL = int(os.getenv("ADMIN_ROLE_TTL") or 30)
+ADMIN_ROLES = frozenset({Roles.MODERATOR, Roles.ADMIN})
+
+# in flight request bounds of the load shedder, and the pool wait that counts as overloaded
+SHED_MAX_CONCURRENCY = int(os.getenv("SHED_MAX_CONCURRENCY") or 256)
+SHED_MIN_CONCURRENCY = int(os.getenv("SHED_MIN_CONCURRENCY") or 8)
+SHED_POOL_WAIT_MS = int(os.getenv("SHED_POOL_WAIT_MS") or 100)
+
+_MISSING = object()
+
+
+class AdminProtectionMiddleware():
+    """
+    Pure ASGI guard locking /admin to users with moderator+ access. Other paths pass straight
+    through, admin requests verify the access token and read the role from a short lived cache,
+    so the many asset requests of an admin page dont each need a db session
+    """
+    def __init__(self, app: ASGIApp, prefix: str = "/admin"):
+        self.app = app
+        self.prefix = prefix
+        self.roles = TTLCache(maxsize=1024, ttl=ADMIN_ROLE_TTL)
+
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+
+        conn = HTTPConnection(scope)
+        token = conn.cookies.get("access_token")
+        if not token:
+            return await self._deny("Missing authorization token", 401)(scope, receive, send)
+
+        username = await access_token_subject(token)
+        if not username:
+            return await self._deny("Invalid tokens", 401)(scope, receive, send)
+
+        role = await self._role(conn, username)
+        if role is None:
+            return await self._deny("User does not exist", 401)(scope, receive, send)
+        if role not in ADMIN_ROLES:
+            return await self._deny("No access", 401)(scope, receive, send)
+
+        await self.app(scope, receive, send)
+
+
+    async def _role(self, conn: HTTPConnection, username: str) -> Roles | None:
+        role = self.roles.get(username, _MISSING)
+        if role is not _MISSING:
+            return role
+
+        try:
+            role = await request_session(conn).scalar(
+                select(User.role).where(User.username==username, User.deleted_at.is_(None)))
+        finally:
+            # sqladmin runs on its own sessions, the check was the only user of this one
+            await close_request_session(conn)
+        self.roles.set(username, role)
+        return role
+
+
+    @staticmethod
+    def _deny(detail: str, status_code: int) -> JSONResponse:
+        return JSONResponse({"detail": detail}, status_code=status_code)
+
+
+class AuthCookieMiddleware():
+    """
+    Adds the cookies of an inline token refresh to the response. Endpoints may return their own
+    Response objects, so the dependency cant set them on the injected response
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookies(message: Message):
+            if message["type"] == "http.response.start":
+                cookies = scope.get("state", {}).get("auth_cookies")
+                if cookies:
+                    message["headers"] = [*message.get("headers", ()), *cookies]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookies)
+
+
+class LoadSheddingMiddleware():
+    """
+    Adaptive cap on in flight requests. While sessions wait longer than SHED_POOL_WAIT_MS for a
+    pooled connection the cap shrinks multiplicatively, once they dont it grows back additively.
+    Requests over the cap get an immediate 503 instead of queueing on the pool behind everyone else
+    """
+    def __init__(self, app: ASGIApp, min_limit: int = SHED_MIN_CONCURRENCY, max_limit: int = SHED_MAX_CONCURRENCY,
+                 pool_wait_threshold: float = SHED_POOL_WAIT_MS / 1000):
+        self.app = app
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.threshold = pool_wait_threshold
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._decreased_at = 0.0
+
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # probes report the dependencies, shedding them would pull an overloaded worker out of rotation
+        if scope["type"] != "http" or scope["path"] in PROBE_PATHS:
+            return await self.app(scope, receive, send)
+
+        if self.in_flight >= self.limit:
+            response = JSONResponse({"detail": "Server overloaded, try again"}, status_code=503,
+                                    headers={"Retry-After": "1"})
+            return await response(scope, receive, send)
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self._adjust()
+
+
+    def _adjust(self):
+        wait = pool_wait.average
+        now = time.monotonic()
+        if wait > self.threshold:
+            # one cut per second, every request finishing in a bad second would otherwise cut again
+            if now - self._decreased_at > 1:
+                self.limit = max(self.min_limit, self.limit * 0.75)
+                self._decreased_at = now
+        elif wait < self.threshold / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
@@ -0,0 +1,12 @@
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+
+def raw_json_response(body: bytes, status_code: int = 200) -> Response:
+    """Wrap already encoded json bytes, bypassing response_model validation and encoding"""
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def adapter_response(adapter: TypeAdapter, data, status_code: int = 200) -> Response:
+    """Dump validated data through a precompiled TypeAdapter straight to a response"""
+    return raw_json_response(adapter.dump_json(data), status_code=status_code)
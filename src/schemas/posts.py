@@ -1,5 +1,5 @@
 import asyncio
-from pydantic import BaseModel, EmailStr, Field, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator, TypeAdapter
 from typing import Optional, Literal
 from enum import StrEnum
 from datetime import datetime
@@ -25,6 +25,12 @@ class Tag(BaseModel):
         from_attributes = True
 
 
+class TagStats(Tag):
+    post_count: int = 0
+    follower_count: int = 0
+    activity: float = 0
+
+
 class PostCreateInitial(BaseModel):
     title: str
     content: str
@@ -54,6 +60,38 @@ class PostRead(BaseModel):
         from_attributes = True
 
 
+class PostInteraction(BaseModel):
+    post_id: int
+    vote: Optional[Literal[-1, 1]] = None
+    bookmarked: bool = False
+
+
+class PostPage(BaseModel):
+    items: list[PostRead] = []
+    next_cursor: Optional[int] = None
+
+
+# Precompiled adapters for hot list endpoints, validate once and dump straight to json bytes
+post_list_adapter = TypeAdapter(list[PostRead])
+post_batch_adapter = TypeAdapter(list[Optional[PostRead]])
+post_interaction_list_adapter = TypeAdapter(list[PostInteraction])
+tag_list_adapter = TypeAdapter(list[Tag])
+tag_stats_list_adapter = TypeAdapter(list[TagStats])
+
+
+class PostImport(AuthorField):
+    """Single ndjson line of a bulk import, ids are always assigned by the db"""
+    title: str = Field(..., max_length=50)
+    content: str
+    status: PostStatus = PostStatus.DRAFT
+    rating: int = 0
+    view_count: int = 0
+    created_at: Optional[datetime] = None
+    published_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    tags: list[str] = []
+
+
 class PostUpdateInitial(BaseModel):
     id: int
     title: Optional[str] = None
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class Suggestion(BaseModel):
+    id: int
+    text: str
+    score: float
+
+
+class Suggestions(BaseModel):
+    tags: list[Suggestion] = []
+    users: list[Suggestion] = []
+    posts: list[Suggestion] = []
@@ -1,8 +1,8 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter
 from typing import Optional
 from enum import StrEnum
 from datetime import datetime
-from .posts import PostRead, Tag
+from .posts import Tag
 
 
 
@@ -47,11 +47,33 @@ class UserRead(BaseModel):
         from_attributes = True
 
 
+user_batch_adapter = TypeAdapter(list[Optional[UserRead]])
+
+
 class Profile(UserRead):
-    bookmarks: list[PostRead] = []
+    bookmark_count: int = 0
     favorite_tags: list[Tag] = []
 
 
+class AuthorStats(BaseModel):
+    user_id: int
+    username: str
+    post_count: int = 0
+    total_rating: int = 0
+    total_views: int = 0
+    comment_count: int = 0
+    karma: int = 0
+
+
+author_stats_list_adapter = TypeAdapter(list[AuthorStats])
+
+
+class DeletionProgress(BaseModel):
+    status: str
+    stage: Optional[str] = None
+    removed_rows: int = 0
+
+
 class UserUpdateInitial(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
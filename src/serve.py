@@ -0,0 +1,53 @@
+"""Production launcher: `python -m src.serve`"""
+import os
+import uvicorn
+
+
+# schema and superuser are deploy steps here, workers start without touching either
+os.environ.setdefault("BOOTSTRAP_ON_STARTUP", "0")
+
+
+def _cpus() -> int:
+    # the cpus this process may run on, a container limited by cpuset sees fewer than the host has
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+HOST = os.getenv("HOST") or "0.0.0.0"
+PORT = int(os.getenv("PORT") or 8000)
+# the app never blocks on cpu for long, one event loop per core keeps every core busy
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY") or _cpus())
+# connections the kernel queues while every worker is busy accepting
+BACKLOG = int(os.getenv("BACKLOG") or 2048)
+# longer than the idle timeout of the load balancer in front, so it closes idle connections first
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT") or 75)
+# hard per worker cap above the load shedder, uvicorn answers 503 past it without running the app
+LIMIT_CONCURRENCY = int(os.getenv("LIMIT_CONCURRENCY") or 1024)
+# on SIGTERM workers stop accepting and finish in flight requests for at most this long
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT") or 30)
+# proxies trusted to set X-Forwarded-For, the rate limits key anonymous clients by the address it resolves to.
+# Comma separated ips or networks of the load balancer, "*" only when nothing else can reach the port
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS") or "127.0.0.1"
+
+
+def main():
+    uvicorn.run(
+        "src.main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        # uvloop and httptools from requirements.txt, "auto" falls back to asyncio and h11 without them
+        loop="auto",
+        http="auto",
+        backlog=BACKLOG,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        limit_concurrency=LIMIT_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
+
+
+if __name__ == '__main__':
+    main()
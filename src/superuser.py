@@ -0,0 +1,13 @@
+"""One-shot superuser bootstrap: `python -m src.superuser`, safe to run on every deploy"""
+import asyncio
+from src.database.core import engine, create_first_superuser, SUPERUSER_NAME
+
+
+async def main():
+    created = await create_first_superuser()
+    await engine.dispose()
+    print(f"Superuser {SUPERUSER_NAME} {'created' if created else 'already exists'}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,3 +1,4 @@
+from typing import AsyncIterator
 from passlib.context import CryptContext
 
 
@@ -9,4 +10,17 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 
 def hash_password(plain_password: str):
-    return pwd_context.hash(plain_password)
\ No newline at end of file
+    return pwd_context.hash(plain_password)
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split an async byte stream into non-empty lines without buffering the whole body"""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
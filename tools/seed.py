@@ -0,0 +1,308 @@
+"""
+Synthetic data for load testing: `python -m tools.seed [--posts 100000 ...]`
+
+Users, tags, posts, comment trees, votes, bookmarks and tag follows are generated with skewed
+popularity, a few posts and tags get most of the attention and a few users do most of the
+voting, and streamed into postgres with binary COPY. The same --seed always produces the same
+rows, so benchmark numbers of different runs are comparable. Every user logs in with SEED_PASSWORD.
+
+Needs DB_URL pointing at a migrated database with empty tables, or --truncate to empty them first.
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import asyncpg
+from dotenv import load_dotenv
+
+from src.database.models.posts import PostStatus
+from src.database.models.users import Roles, OccupationGrades
+from src.utils import pwd_context
+
+
+load_dotenv()
+
+SEED_PASSWORD = "seed-password"
+# fixed rather than now, a rerun with the same seed writes the same timestamps
+SEED_END = datetime(2025, 1, 1)
+HISTORY = timedelta(days=2 * 365)
+CORPUS_SIZE = 1 << 20
+BCRYPT_SALT_ALPHABET = "./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+WORDS = (
+    "async await python fastapi postgres index query cache redis latency throughput worker pool "
+    "connection transaction vacuum planner join hash sort memory buffer page disk network socket "
+    "request response header cookie token session schema migration column table row tuple lock "
+    "deadlock timeout retry backoff queue stream event loop thread process kernel scheduler cpu "
+    "profile benchmark regression deploy container cluster replica shard partition backup restore "
+    "the a of to and in is it that for on with as was be this by are or from at an but not have"
+).split()
+FIRST_NAMES = ["Alex", "Sam", "Maria", "Ivan", "Chen", "Aisha", "Lucas", "Emma", "Noah", "Olga", "Yuki", "Omar"]
+LAST_NAMES = ["Smith", "Ivanova", "Garcia", "Kim", "Müller", "Rossi", "Novak", "Silva", "Tanaka", "Khan"]
+OCCUPATIONS = ["Backend developer", "Frontend developer", "DevOps engineer", "Data scientist", "QA engineer", None]
+# tables in load order, truncated in reverse
+TABLES = ["users", "tags", "posts", "tags_to_posts", "comments", "votes", "bookmarks", "tags_to_users"]
+SEQUENCES = ["users", "tags", "posts", "comments", "votes"]
+
+
+class Zipf():
+    """Draws 1..n, rank k with probability proportional to 1 / k^s, ranks mapped to shuffled ids"""
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.cumulative = list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+        self.ids = list(range(1, n + 1))
+        # otherwise the oldest rows would always be the most popular ones
+        rng.shuffle(self.ids)
+
+    def draw(self, rng: random.Random) -> int:
+        return self.ids[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+    def distinct(self, rng: random.Random, k: int) -> set[int]:
+        """Up to k different ids, popular ones first, gives up on the tail after 20 * k draws"""
+        k = min(k, len(self.ids))
+        chosen = set()
+        for _ in range(20 * k):
+            chosen.add(self.draw(rng))
+            if len(chosen) == k:
+                break
+        return chosen
+
+
+def popular_posts(seed: int, posts: int, skew: float) -> Zipf:
+    """Post popularity of a seeded database, load tests hit the posts that got the votes and comments"""
+    return Zipf(posts, skew, random.Random(f"{seed}:popular_posts"))
+
+
+def heavy_tail(rng: random.Random, mean: float, cap: int, alpha: float = 1.5) -> int:
+    """Pareto distributed count with roughly the given mean, most draws are small and a few huge"""
+    return min(cap, int(mean * (alpha - 1) / alpha * rng.paretovariate(alpha)))
+
+
+class Text():
+    """Slices of one pregenerated corpus, building every post word by word would dominate the run"""
+    def __init__(self, rng: random.Random):
+        words = []
+        size = 0
+        while size < CORPUS_SIZE:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        self.corpus = " ".join(words)
+
+    def take(self, rng: random.Random, length: int) -> str:
+        start = rng.randrange(len(self.corpus) - length)
+        return self.corpus[start:start + length].strip() or "empty"
+
+    def lognormal(self, rng: random.Random, median: int, low: int, high: int) -> str:
+        # content lengths are log-normal, most posts are a few screens and a few are essays
+        length = int(median * rng.lognormvariate(0, 0.7))
+        return self.take(rng, max(low, min(high, length)))
+
+
+class Generator():
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.seed = args.seed
+        setup = self.rng("setup")
+        self.text = Text(setup)
+        self.popular_posts = popular_posts(self.seed, args.posts, args.skew)
+        self.popular_tags = Zipf(args.tags, args.skew, setup)
+        self.authors = Zipf(args.users, args.author_skew, setup)
+        self.password = self.password_hash(setup)
+
+
+    def rng(self, table: str) -> random.Random:
+        # one stream per table, changing the volume of one table leaves the others as they were
+        return random.Random(f"{self.seed}:{table}")
+
+
+    def password_hash(self, rng: random.Random) -> str:
+        """One hash shared by every user, with a seeded salt, a random one would differ between runs"""
+        # the last salt character only carries 2 bits, bcrypt accepts four values there
+        salt = "".join(rng.choice(BCRYPT_SALT_ALPHABET) for _ in range(21)) + rng.choice(".Oeu")
+        return pwd_context.handler("bcrypt").using(salt=salt).hash(SEED_PASSWORD)
+
+
+    def created_at(self, index: int, total: int) -> datetime:
+        """Ids grow with creation time, like they do in production"""
+        return SEED_END - HISTORY + HISTORY * (index / total)
+
+
+    def users(self) -> Iterator[tuple]:
+        rng = self.rng("users")
+        for id in range(1, self.args.users + 1):
+            occupation = rng.choice(OCCUPATIONS)
+            yield (
+                id, f"user{id}", f"user{id}@example.com", self.password,
+                rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                self.text.lognormal(rng, 200, 20, 1000) if rng.random() < 0.5 else None,
+                occupation, rng.choice(list(OccupationGrades)).name if occupation else None,
+                self.created_at(id, self.args.users) + timedelta(days=rng.random() * 30), None,
+                self.created_at(id, self.args.users), rng.random() < 0.7,
+                Roles.ADMIN.name if id == 1 else Roles.USER.name,
+            )
+
+
+    def tags(self) -> Iterator[tuple]:
+        rng = self.rng("tags")
+        names = set()
+        for id in range(1, self.args.tags + 1):
+            name = "-".join(rng.sample(WORDS, 2))
+            while name in names:
+                name = f"{name}-{id}"
+            names.add(name)
+            yield id, name[:50]
+
+
+    def posts(self) -> Iterator[tuple]:
+        rng = self.rng("posts")
+        for id in range(1, self.args.posts + 1):
+            created_at = self.created_at(id, self.args.posts)
+            status = rng.choices([PostStatus.PUBLIC, PostStatus.DRAFT, PostStatus.ARCHIVED], weights=[85, 10, 5])[0]
+            yield (
+                id, self.authors.draw(rng), self.text.take(rng, rng.randint(15, 50)).capitalize(),
+                self.text.lognormal(rng, 2500, 200, 20000),
+                created_at + timedelta(hours=rng.random()) if status == PostStatus.PUBLIC else None,
+                None, created_at, created_at,
+                # votes are loaded later, the ratings are summed from them at the end
+                0, heavy_tail(rng, 300, 1_000_000), status.name,
+            )
+
+
+    def tags_to_posts(self) -> Iterator[tuple]:
+        rng = self.rng("tags_to_posts")
+        for post_id in range(1, self.args.posts + 1):
+            for tag_id in self.popular_tags.distinct(rng, rng.randint(1, 4)):
+                yield post_id, tag_id
+
+
+    def comments(self) -> Iterator[tuple]:
+        """Trees, a comment answers the post or an earlier comment of the same post"""
+        rng = self.rng("comments")
+        id = 0
+        for post_id in range(1, self.args.posts + 1):
+            posted_at = self.created_at(post_id, self.args.posts)
+            first_id = id + 1
+            for offset in range(heavy_tail(rng, self.args.comments_per_post, 1000)):
+                id += 1
+                parent_id = rng.randint(first_id, id - 1) if offset and rng.random() < 0.4 else None
+                yield (
+                    id, self.text.lognormal(rng, 200, 5, 3000), rng.randint(1, self.args.users),
+                    post_id, parent_id, posted_at + timedelta(minutes=offset * 10 + rng.random() * 10),
+                )
+
+
+    def votes(self) -> Iterator[tuple]:
+        rng = self.rng("votes")
+        id = 0
+        for user_id in range(1, self.args.users + 1):
+            count = heavy_tail(rng, self.args.votes_per_user, self.args.posts // 10)
+            for post_id in self.popular_posts.distinct(rng, count):
+                id += 1
+                yield id, user_id, post_id, 1 if rng.random() < 0.85 else -1
+
+
+    def bookmarks(self) -> Iterator[tuple]:
+        rng = self.rng("bookmarks")
+        for user_id in range(1, self.args.users + 1):
+            count = heavy_tail(rng, self.args.bookmarks_per_user, self.args.posts // 10)
+            for post_id in self.popular_posts.distinct(rng, count):
+                yield user_id, post_id
+
+
+    def tags_to_users(self) -> Iterator[tuple]:
+        rng = self.rng("tags_to_users")
+        for user_id in range(1, self.args.users + 1):
+            for tag_id in self.popular_tags.distinct(rng, heavy_tail(rng, self.args.follows_per_user, 50)):
+                yield user_id, tag_id
+
+
+COLUMNS = {
+    "users": ["id", "username", "email", "password", "first_name", "last_name", "bio", "occupation",
+              "occupation_grade", "last_login", "deleted_at", "created_at", "is_verified", "role"],
+    "tags": ["id", "name"],
+    "posts": ["id", "author_id", "title", "content", "published_at", "deleted_at", "created_at", "updated_at",
+              "rating", "view_count", "status"],
+    "tags_to_posts": ["post_id", "tag_id"],
+    "comments": ["id", "content", "author_id", "post_id", "parent_id", "created_at"],
+    "votes": ["id", "author_id", "post_id", "value"],
+    "bookmarks": ["user_id", "post_id"],
+    "tags_to_users": ["user_id", "tag_id"],
+}
+
+FINISH_SQL = [
+    *(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 1)) FROM {table}"
+      for table in SEQUENCES),
+    """
+    UPDATE posts SET rating = v.rating
+    FROM (SELECT post_id, sum(value) AS rating FROM votes GROUP BY post_id) v
+    WHERE posts.id = v.post_id
+    """,
+    "REFRESH MATERIALIZED VIEW author_stats",
+    "ANALYZE",
+]
+
+
+class Counted():
+    """Passes rows through while counting them, COPY only reports a status string"""
+    def __init__(self, rows: Iterator[tuple]):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+async def seed(args: argparse.Namespace):
+    generator = Generator(args)
+    conn = await asyncpg.connect(os.getenv("DB_URL").replace("+asyncpg", ""))
+    try:
+        if args.truncate:
+            await conn.execute(f"TRUNCATE {', '.join(reversed(TABLES))} RESTART IDENTITY CASCADE")
+        elif await conn.fetchval("SELECT EXISTS (SELECT 1 FROM users)"):
+            raise SystemExit("users is not empty, rerun with --truncate to replace its contents")
+
+        started = time.perf_counter()
+        total = 0
+        for table in TABLES:
+            table_started = time.perf_counter()
+            rows = Counted(getattr(generator, table)())
+            await conn.copy_records_to_table(table, records=rows, columns=COLUMNS[table])
+            elapsed = time.perf_counter() - table_started
+            total += rows.count
+            print(f"{table:<15} {rows.count:>10} rows  {elapsed:>7.1f} s  {rows.count / elapsed * 60:>12,.0f} rows/min")
+
+        for statement in FINISH_SQL:
+            await conn.execute(statement)
+        elapsed = time.perf_counter() - started
+        print(f"{'total':<15} {total:>10} rows  {elapsed:>7.1f} s  {total / elapsed * 60:>12,.0f} rows/min")
+    finally:
+        await conn.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m tools.seed", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--comments-per-post", type=float, default=8)
+    parser.add_argument("--votes-per-user", type=float, default=30)
+    parser.add_argument("--bookmarks-per-user", type=float, default=5)
+    parser.add_argument("--follows-per-user", type=float, default=5)
+    parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent of post, tag and author popularity")
+    parser.add_argument("--author-skew", type=float, default=0.8,
+                        help="zipf exponent of posts per author, lower than --skew or one author writes everything")
+    parser.add_argument("--truncate", action="store_true", help="empty the seeded tables first")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(seed(parse_args()))